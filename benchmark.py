@@ -0,0 +1,737 @@
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import argparse
+import functools
+import importlib
+import inspect
+import tempfile
+import threading
+import contextlib
+import tracemalloc
+import cv2
+import numpy as np
+from pydantic import HttpUrl
+from types import SimpleNamespace
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from inference import InferenceEngine
+from layout import OutputLayout
+from neardup import HashCache
+from shards import create_pool, for_each
+from video import is_video
+
+STAGES = ("download", "detection", "match")
+
+# Side of the corner block whose brightness tells the stub models how many people an image shows
+MARKER = 16
+
+def make_image(rng, width, height, persons):
+    """Smooth noise with a few shapes, compresses about like a photo, persons is encoded in the corner block."""
+    img = rng.integers(0, 256, (max(1, height // 8), max(1, width // 8), 3), dtype=np.uint8)
+    img = cv2.resize(img, (width, height), interpolation=cv2.INTER_LINEAR)
+    for _ in range(int(rng.integers(3, 8))):
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        cv2.circle(img, (x, y), int(rng.integers(10, max(11, width // 4))), color, -1)
+    img[:MARKER, :MARKER] = persons * 127
+    return img
+
+def marker(img):
+    return int(round(float(img[:MARKER, :MARKER].mean()) / 127))
+
+def write_video(path, rng, width, height, frames, persons):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 30, (width, height))
+    base = make_image(rng, width, height, persons)
+    for index in range(frames):
+        # Pan across the base image so frames differ like a real clip
+        frame = np.roll(base, index * 4, axis=1)
+        frame[:MARKER, :MARKER] = persons * 127
+        writer.write(frame)
+    writer.release()
+
+def encode_jpeg(img):
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+def encode_video(rng, width, height, frames):
+    fd, path = tempfile.mkstemp(suffix=".mp4")
+    os.close(fd)
+    try:
+        write_video(path, rng, width, height, frames, 1)
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+class Stage:
+    """Throughput, latencies and peak memory of one benchmark stage.
+
+    items and bytes are what the stage produced, latencies are the samples
+    of its unit of work (one API call, one transfer, one model batch), so
+    the two don't need to count the same thing.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.items = 0
+        self.bytes = 0
+        self.latencies = []
+        self.elapsed = 0.0
+        self.peak = None
+        self.children = []
+
+    def child(self, name):
+        stage = Stage(f"{self.name}.{name}")
+        self.children.append(stage)
+        return stage
+
+    def count(self, items, size=0):
+        with self.lock:
+            self.items += items
+            self.bytes += size
+
+    def sample(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+
+    def summary(self):
+        latencies = np.array(self.latencies) * 1000
+        percentile = lambda q: round(float(np.percentile(latencies, q)), 2) if len(latencies) else None
+        return {
+            "items": self.items,
+            "bytes": self.bytes,
+            "seconds": round(self.elapsed, 3),
+            "items_per_s": round(self.items / self.elapsed, 2) if self.elapsed else None,
+            "bytes_per_s": round(self.bytes / self.elapsed, 1) if self.elapsed else None,
+            "samples": len(latencies),
+            "p50_ms": percentile(50),
+            "p90_ms": percentile(90),
+            "p99_ms": percentile(99),
+            "max_ms": round(float(latencies.max()), 2) if len(latencies) else None,
+            "peak_mb": round(self.peak / 1048576, 1) if self.peak is not None else None,
+        }
+
+def timed(stage, func):
+    """func recording the latency of every call into stage."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stage.sample(time.perf_counter() - start)
+    return wrapper
+
+def run_stage(stages, name, func, verbose=False, trace=True):
+    """Run func(stage) with its output silenced, timing it and tracking its peak Python memory."""
+    stage = Stage(name)
+    print(f"Running {name}")
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+        func(stage)
+    stage.elapsed = time.perf_counter() - start
+    if trace:
+        stage.peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    for child in stage.children:
+        child.elapsed = stage.elapsed
+        child.peak = stage.peak
+    stages.append(stage)
+    return stage
+
+class CDN:
+    """Local stand-in for the Instagram CDN, serves generated JPEG and MP4 payloads.
+
+    Any path ending in .jpg or .mp4 is served, picked from a few variants by
+    its hash. Range requests are answered like the real CDN does, so resumes
+    take the same code path. latency delays the first byte of every response.
+    """
+
+    def __init__(self, width=1080, height=1350, video_frames=90, latency=0.0, variants=4, seed=0):
+        rng = np.random.default_rng(seed)
+        self.latency = latency
+        self.payloads = {
+            ".jpg": [encode_jpeg(make_image(rng, width, height, 1)) for _ in range(variants)],
+            ".mp4": [encode_video(rng, width // 2, height // 2, video_frames) for _ in range(variants)],
+        }
+        cdn = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                payload = cdn.payload(self.path)
+                if cdn.latency:
+                    time.sleep(cdn.latency)
+                if payload is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                start = 0
+                range_header = self.headers.get("Range", "")
+                if range_header.startswith("bytes="):
+                    start = int(range_header[6:].split("-")[0] or 0)
+                    if start >= len(payload):
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{len(payload)}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{len(payload) - 1}/{len(payload)}")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", str(len(payload) - start))
+                self.end_headers()
+                self.wfile.write(payload[start:])
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def payload(self, path):
+        ext = os.path.splitext(path.split("?")[0])[1]
+        variants = self.payloads.get(ext)
+        if not variants:
+            return None
+        return variants[zlib.crc32(path.encode()) % len(variants)]
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server.server_port}/{path}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class FakeClient:
+    """Stands in for instagrapi.Client, answers from generated media after latency seconds per call.
+
+    Every user has the same number of posts (every carousel_every-th one a
+    carousel, every video_every-th one a video), reels, stories and
+    highlights, newest first one hour apart, with URLs on the local CDN.
+    """
+
+    def __init__(self, cdn, posts=60, reels=10, stories=5, highlights=3, highlight_items=4, carousel=3,
+                 carousel_every=5, video_every=7, latency=0.05):
+        self.cdn = cdn
+        self.posts = posts
+        self.reels = reels
+        self.stories = stories
+        self.highlights = highlights
+        self.highlight_items = highlight_items
+        self.carousel = carousel
+        self.carousel_every = carousel_every
+        self.video_every = video_every
+        self.latency = latency
+        self.now = datetime.now(timezone.utc).replace(microsecond=0)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.user_id = "0"
+        self.uuid = "benchmark"
+
+    def call(self):
+        with self.lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def media(self, pk, kind, index, media_type=1, video=False):
+        """A media like instagrapi's, whose thumbnail_url and video_url are pydantic HttpUrl."""
+        image_url = self.cdn.url(f"{kind}/{pk}.jpg")
+        return SimpleNamespace(
+            pk=pk,
+            taken_at=self.now - timedelta(hours=index),
+            media_type=media_type,
+            thumbnail_url=HttpUrl(image_url),
+            video_url=HttpUrl(self.cdn.url(f"{kind}/{pk}.mp4")) if video else None,
+            image_versions2={"candidates": [{"url": image_url}]},
+            resources=[],
+        )
+
+    def post(self, user_id, index):
+        pk = f"{user_id}1{index:06d}"
+        if index % self.carousel_every == self.carousel_every - 1:
+            post = self.media(pk, "posts", index, media_type=8)
+            post.resources = [self.media(f"{pk}{r}", "posts", index, video=r == self.carousel - 1 and r > 0)
+                              for r in range(self.carousel)]
+            return post
+        if index % self.video_every == self.video_every - 1:
+            return self.media(pk, "posts", index, media_type=2, video=True)
+        return self.media(pk, "posts", index)
+
+    def paginate(self, make, total, amount, end_cursor):
+        start = int(end_cursor or 0)
+        end = min(start + (amount or total), total)
+        return [make(index) for index in range(start, end)], str(end) if end < total else ""
+
+    def user_id_from_username(self, username):
+        self.call()
+        return str(zlib.crc32(username.encode()) % 10 ** 9 + 10 ** 9)
+
+    def user_medias_paginated(self, user_id, amount=0, end_cursor=""):
+        self.call()
+        return self.paginate(lambda index: self.post(user_id, index), self.posts, amount, end_cursor)
+
+    def user_clips_paginated_v1(self, user_id, amount=50, end_cursor=""):
+        self.call()
+        make = lambda index: self.media(f"{user_id}2{index:06d}", "reels", index, media_type=2, video=True)
+        return self.paginate(make, self.reels, amount, end_cursor)
+
+    def user_stories(self, user_id, amount=None):
+        self.call()
+        return [self.media(f"{user_id}3{index:06d}", "stories", index, media_type=2 if index % 2 else 1, video=index % 2 == 1)
+                for index in range(self.stories)]
+
+    def user_highlights(self, user_id, amount=0):
+        from instagrapi.types import Highlight, UserShort
+        self.call()
+        return [
+            Highlight(
+                pk=f"{user_id}4{index:03d}", id=f"highlight:{user_id}4{index:03d}",
+                latest_reel_media=int((self.now - timedelta(days=index)).timestamp()),
+                cover_media={}, user=UserShort(pk=user_id), title=f"Highlight {index + 1}",
+                created_at=self.now - timedelta(days=index), is_pinned_highlight=False,
+                media_count=self.highlight_items,
+            )
+            for index in range(self.highlights)
+        ]
+
+    def highlight_info(self, highlight_pk):
+        self.call()
+        return SimpleNamespace(items=[
+            self.media(f"{highlight_pk}{index:03d}", "highlights", index, media_type=1)
+            for index in range(self.highlight_items)
+        ])
+
+    def private_request(self, endpoint, data=None, params=None):
+        """The raw JSON of feed/reels_media/, the only private endpoint download.py calls directly."""
+        if endpoint != "feed/reels_media/":
+            raise NotImplementedError(endpoint)
+        self.call()
+        reels = {}
+        for reel_id in data["user_ids"]:
+            highlight_pk = reel_id.split(":")[-1]
+            user = {"pk": highlight_pk[:-4], "username": "benchmark"}
+            items = []
+            for index in range(self.highlight_items):
+                pk = f"{highlight_pk}{index:03d}"
+                items.append({
+                    "pk": pk, "id": f"{pk}_{user['pk']}", "media_type": 1, "product_type": "story", "user": user,
+                    "taken_at": int((self.now - timedelta(hours=index)).timestamp()),
+                    "image_versions2": {"candidates": [{"url": self.cdn.url(f"highlights/{pk}.jpg"), "width": 1080, "height": 1920}]},
+                })
+            reels[reel_id] = {
+                "id": reel_id, "latest_reel_media": int(self.now.timestamp()), "cover_media": {}, "user": user,
+                "title": "Highlight", "created_at": int(self.now.timestamp()), "is_pinned_highlight": False,
+                "media_count": len(items), "items": items,
+            }
+        return {"reels": reels}
+
+    def account_info(self):
+        self.call()
+        return SimpleNamespace(username="benchmark")
+
+def stub_result(image):
+    """A YOLO-like result with one person box per marker step, sized to pass match.py's person test."""
+    h, w = image.shape[:2]
+    count = marker(image)
+    xyxy = [[w * (0.1 + 0.45 * i), h * 0.2, w * (0.45 + 0.45 * i), h * 0.95] for i in range(count)]
+    return SimpleNamespace(
+        names={0: "person"},
+        boxes=SimpleNamespace(cls=[0] * count, conf=[0.9] * count, xyxy=xyxy),
+    )
+
+class StubEngine(InferenceEngine):
+    """InferenceEngine with a stand-in model, decoding, batching and prefetch stay real.
+
+    predict sleeps delay seconds per image in place of the model's compute.
+    """
+
+    def __init__(self, batch_size=16, decode_workers=4, prefetch=2, delay=0.0, metrics=None):
+        self.device = "cpu"
+        self.metrics = metrics
+        self.batch_size = batch_size
+        self.decode_workers = decode_workers
+        self.prefetch = prefetch
+        self.delay = delay
+
+    def predict(self, images):
+        if self.delay:
+            time.sleep(self.delay * len(images))
+        return [stub_result(image) for image in images]
+
+def init_stub_shard(repo, model, batch_size, decode_workers, detect_delay, identities, face_delay):
+    """Set up a pool process like main() sets up this one, the stage modules read their config from repo."""
+    cwd = os.getcwd()
+    os.chdir(repo)
+    try:
+        import detection
+        import match
+    finally:
+        os.chdir(cwd)
+    if model:
+        detection.engine = InferenceEngine(model, device="cpu", batch_size=batch_size, imgsz=detection.imgsz,
+                                           conf=detection.conf_floor, iou=detection.iou, decode_workers=decode_workers)
+    else:
+        detection.engine = StubEngine(batch_size=batch_size, decode_workers=decode_workers, delay=detect_delay)
+    match.analyze = stub_analyzer(identity_centers(identities), match.sample_video, face_delay)
+
+def identity_centers(identities, dim=512, seed=0):
+    centers = np.random.default_rng(seed).normal(size=(identities, dim))
+    return centers / np.linalg.norm(centers, axis=1, keepdims=True)
+
+def stub_analyzer(centers, sample_video, delay=0.0, noise=0.5):
+    """Stand-in for match.analyze: decodes the file like the real one, faces come from the corpus.
+
+    The first face of an image belongs to the identity in its file name,
+    any further ones to random identities, each embedding is that
+    identity's center plus noise of the given norm.
+    """
+    dim = centers.shape[1]
+
+    def faces(rng, identity, count, frame=None):
+        found = []
+        for i in range(count):
+            who = identity if i == 0 else int(rng.integers(0, len(centers)))
+            embedding = centers[who] + rng.normal(size=dim) * noise / np.sqrt(dim)
+            embedding = (embedding / np.linalg.norm(embedding)).astype(np.float32)
+            bbox = [40.0 + 60 * i, 40.0, 90.0 + 60 * i, 100.0]
+            found.append((bbox, 0.8, embedding) if frame is None else (bbox, 0.8, embedding, frame))
+        return found
+
+    def analyze(img_path, persons=None):
+        name = os.path.basename(img_path)
+        rng = np.random.default_rng(zlib.crc32(name.encode()))
+        identity = int(os.path.splitext(name)[0].rsplit("_", 1)[-1])
+        if delay:
+            time.sleep(delay)
+        if is_video(img_path):
+            found = []
+            for frame_index, frame in sample_video(img_path):
+                found.extend(faces(rng, identity, marker(frame), frame_index))
+            return found
+        img = cv2.imread(img_path)
+        if img is None:
+            return None
+        return faces(rng, identity, marker(img))
+
+    return analyze
+
+def make_corpus(folder, images, videos, identities, width, height, target_share=0.5, reposts=0.0, seed=0):
+    """Write images and clips named <index>_<identity>, identity 0 is the target.
+
+    A reposts share of the images is also written to stories at a lower
+    JPEG quality, near-duplicates with different bytes. Returns the number
+    of files and their total size in bytes.
+    """
+    rng = np.random.default_rng(seed)
+    for kind in ("posts", "reels", "stories"):
+        os.makedirs(os.path.join(folder, kind), exist_ok=True)
+    paths = []
+    for index in range(images + videos):
+        identity = 0 if rng.random() < target_share else int(rng.integers(1, identities))
+        persons = int(rng.choice([0, 1, 1, 1, 2]))
+        if index < images:
+            path = os.path.join(folder, "posts", f"{index:05d}_{identity}.jpg")
+            img = make_image(rng, width, height, persons)
+            cv2.imwrite(path, img)
+            # Drawn only with reposts, the default corpus stays comparable to older baselines
+            if reposts and rng.random() < reposts:
+                paths.append(os.path.join(folder, "stories", f"{index:05d}_{identity}.jpg"))
+                cv2.imwrite(paths[-1], img, [cv2.IMWRITE_JPEG_QUALITY, 70])
+        else:
+            path = os.path.join(folder, "reels", f"{index:05d}_{identity}.mp4")
+            write_video(path, rng, width // 2, height // 2, 90, persons)
+        paths.append(path)
+    return len(paths), sum(os.path.getsize(path) for path in paths)
+
+def setup_download(root, client, cwd):
+    """Import download.py with the config.json of cwd, then point its module state at root and the fake client."""
+    from blobs import BlobStore
+    from cache import MetadataCache
+    from inbox import Inbox
+    from manifest import Manifest
+    from metrics import Metrics
+    from scheduler import Scheduler
+
+    # The objects built at import use the data folder next to download.py, removed again if the import made it
+    real_data = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    made = not os.path.exists(real_data)
+    os.chdir(cwd)
+    try:
+        download = importlib.import_module("download")
+    finally:
+        os.chdir(root)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        download.downloader.close()
+    download.manifest.close()
+    download.cache.close()
+    if made:
+        shutil.rmtree(real_data, ignore_errors=True)
+
+    download.data_dir = os.path.join(root, "data")
+    os.makedirs(download.data_dir, exist_ok=True)
+    download.cl = client
+    download.metrics = Metrics("download")
+    download.scheduler = Scheduler(api_delay=(0, 0), target_delay=(0, 0),
+                                   cdn_rate_limit=download.config.get("cdn_rate_limit", 0), metrics=download.metrics)
+    download.manifest = Manifest(os.path.join(download.data_dir, "manifest.db"))
+    download.cache = MetadataCache(os.path.join(download.data_dir, "cache.db"))
+    if download.blobs:
+        download.blobs = BlobStore(os.path.join(download.data_dir, ".blobs"))
+    if download.inbox:
+        download.inbox.close()
+        download.inbox = Inbox(os.path.join(download.data_dir, "stream.db"))
+    return download
+
+def bench_download(download, users):
+    def run(stage):
+        api = stage.child("api")
+        transfer = stage.child("transfer")
+        download.scheduler.api = timed(api, inspect.unwrap(download.scheduler.api))
+        download.downloader = download.create_downloader()
+        download.downloader.transfer = timed(transfer, download.downloader.transfer)
+        calls = download.cl.calls
+
+        for user in users:
+            download.download_posts(user)
+            download.download_highlights(user)
+            download.download_stories(user)
+            download.download_reels(user)
+        failed = download.downloader.close()
+
+        completed = download.downloader.done - len(failed)
+        stage.count(completed, download.downloader.bytes)
+        api.count(download.cl.calls - calls)
+        transfer.count(completed, download.downloader.bytes)
+        if failed:
+            print(f"{len(failed)} Downloads Failed", file=sys.__stdout__)
+    return run
+
+def bench_detection(users, engine, cache_key, sizes, processes=1):
+    import detection
+    from resultcache import ResultCache
+    from video import sampling_key
+
+    def run(stage):
+        predict = stage.child("predict")
+        engine.predict = timed(predict, inspect.unwrap(engine.predict))
+        detection.engine = engine
+        detection.cache = ResultCache(os.path.join("output", "detection_cache.db"), cache_key)
+        detection.video_cache = ResultCache(os.path.join("output", "detection_cache.db"),
+                                            f"{cache_key}|{sampling_key(detection.config)}")
+        if detection.hash_kind:
+            detection.hashes = HashCache(os.path.join("output", "hashes.db"), detection.hash_kind)
+        for_each(detection.detect_user, users, processes)
+        detection.cache.close()
+        detection.video_cache.close()
+        if detection.hashes is not None:
+            detection.hashes.close()
+        stage.count(sum(count for count, _ in sizes.values()), sum(size for _, size in sizes.values()))
+        predict.count(len(predict.latencies))
+    return run
+
+def bench_match(users, analyze, processes=1):
+    import match
+
+    def run(stage):
+        embed = stage.child("embed")
+        match.analyze = timed(embed, analyze)
+        if match.hash_kind:
+            match.hashes = HashCache(os.path.join("output", "hashes.db"), match.hash_kind)
+        for_each(match.self_train_user, users, processes)
+        for user in users:
+            stage.count(len(OutputLayout(os.path.join("output", user), match.output_mode).entries("detected")))
+        embed.count(len(embed.latencies))
+        if match.hashes is not None:
+            match.hashes.close()
+    return run
+
+def seed_single(users, seeds, output_mode):
+    """Put a few one-person images of the target into single, descent needs them to start."""
+    for user in users:
+        layout = OutputLayout(os.path.join("output", user), output_mode)
+        picked = 0
+        for name, path in sorted(layout.entries("detected")):
+            if picked >= seeds:
+                break
+            if name.endswith("_0.jpg"):
+                img = cv2.imread(path)
+                if img is not None and marker(img) == 1:
+                    layout.place(path, "single", name)
+                    picked += 1
+        layout.save()
+
+def report(stages, baseline=None):
+    columns = ("Items", "Items/s", "MB/s", "p50 ms", "p90 ms", "p99 ms", "Max ms", "Peak MB")
+    print(f"\n{'Stage':<24}" + "".join(f"{column:>10}" for column in columns))
+    rows = [(row, indent) for stage in stages for row, indent in [(stage, ""), *((child, "  ") for child in stage.children)]]
+
+    def cell(value, fmt="{:.1f}"):
+        return f"{'-' if value is None else fmt.format(value):>10}"
+
+    for stage, indent in rows:
+        s = stage.summary()
+        mb_s = s["bytes_per_s"] / 1048576 if s["bytes_per_s"] else None
+        print(f"{indent + stage.name:<24}{cell(s['items'], '{}')}{cell(s['items_per_s'])}{cell(mb_s, '{:.2f}')}"
+              f"{cell(s['p50_ms'])}{cell(s['p90_ms'])}{cell(s['p99_ms'])}{cell(s['max_ms'])}{cell(s['peak_mb'])}")
+
+    try:
+        import resource
+        # ru_maxrss is in KB on Linux
+        print(f"\nMax RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+    except ImportError:
+        pass
+
+    if baseline:
+        print("\nCompared to Baseline:")
+        for stage, indent in rows:
+            before = baseline.get("stages", {}).get(stage.name, {}).get("items_per_s")
+            after = stage.summary()["items_per_s"]
+            if before and after:
+                print(f"{indent + stage.name:<24}{before:>10.1f} -> {after:<10.1f}{(after / before - 1) * 100:+.1f}%")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the download, detection and match stages.")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Comma separated stages to run")
+    parser.add_argument("--users", type=int, default=2, help="Fake targets to download and corpora to process")
+    parser.add_argument("--posts", type=int, default=60)
+    parser.add_argument("--reels", type=int, default=10)
+    parser.add_argument("--stories", type=int, default=5)
+    parser.add_argument("--highlights", type=int, default=3)
+    parser.add_argument("--highlight-items", type=int, default=4)
+    parser.add_argument("--api-latency", type=float, default=0.05, help="Seconds per fake API call")
+    parser.add_argument("--cdn-latency", type=float, default=0.0, help="Seconds to first byte of every CDN response")
+    parser.add_argument("--images", type=int, default=200, help="Generated images per corpus")
+    parser.add_argument("--videos", type=int, default=4, help="Generated clips per corpus")
+    parser.add_argument("--identities", type=int, default=8)
+    parser.add_argument("--reposts", type=float, default=0.0, help="Share of images also reposted as a recompressed story")
+    parser.add_argument("--size", default="640x480", help="Width x height of the corpus images")
+    parser.add_argument("--seeds", type=int, default=5, help="Target images put into single before matching")
+    parser.add_argument("--model", help="Run this YOLO model on CPU instead of the stub, its boxes decide what match sees")
+    parser.add_argument("--detect-delay", type=float, default=0.0, help="Seconds per image the stub detector spends")
+    parser.add_argument("--face-delay", type=float, default=0.0, help="Seconds per file the stub face model spends")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Run detection and match with a pool of this many processes, their predict and embed aren't timed")
+    parser.add_argument("--match-mode", choices=("descent", "cluster"), help="Override match_mode of setting.json")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare items/s to a JSON file written by --output")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="Skip per-stage peak memory, it slows Python code")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch folder")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the stages")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    selected = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    for stage in selected:
+        if stage not in STAGES:
+            print(f"Unknown Stage {stage}, Expected One of {', '.join(STAGES)}")
+            sys.exit(1)
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    trace = not args.no_tracemalloc
+
+    # The stage modules read config.json and setting.json from here on import, download.py in setup_download
+    import detection
+    import match
+
+    root = tempfile.mkdtemp(prefix="benchmark_")
+    cwd = os.getcwd()
+    stages = []
+    pool = None
+    print(f"Scratch Folder: {root}")
+    try:
+        os.chdir(root)
+        if "download" in selected:
+            cdn = CDN(latency=args.cdn_latency)
+            client = FakeClient(cdn, posts=args.posts, reels=args.reels, stories=args.stories,
+                                highlights=args.highlights, highlight_items=args.highlight_items,
+                                latency=args.api_latency)
+            module = setup_download(root, client, cwd)
+            users = [f"bench_{index + 1}" for index in range(args.users)]
+            run_stage(stages, "download", bench_download(module, users), args.verbose, trace)
+            # Everything is known now, this measures the incremental listing
+            run_stage(stages, "download.rerun", bench_download(module, users), args.verbose, trace)
+            module.manifest.close()
+            module.cache.close()
+            cdn.close()
+
+        if "detection" in selected or "match" in selected:
+            corpora = [f"corpus_{index + 1}" for index in range(args.users)]
+            print("Generating Corpus")
+            sizes = {}
+            for index, user in enumerate(corpora):
+                sizes[user] = make_corpus(os.path.join(root, "data", user), args.images, args.videos, args.identities,
+                                          width, height, reposts=args.reposts, seed=index)
+
+            if args.model:
+                from resultcache import model_key
+                engine = InferenceEngine(args.model, device="cpu", batch_size=detection.config.get("batch_size", 16),
+                                         imgsz=detection.imgsz, conf=detection.conf_floor, iou=detection.iou,
+                                         decode_workers=detection.config.get("decode_workers", 4))
+                cache_key = model_key(args.model, "torch", detection.imgsz, detection.conf_floor, detection.iou)
+            else:
+                engine = StubEngine(batch_size=detection.config.get("batch_size", 16),
+                                    decode_workers=detection.config.get("decode_workers", 4), delay=args.detect_delay)
+                cache_key = f"stub|{args.detect_delay}"
+
+            if args.processes > 1:
+                pool = create_pool(args.processes, detection.shard_threads, init_stub_shard,
+                                   (cwd, args.model, detection.config.get("batch_size", 16),
+                                    detection.config.get("decode_workers", 4), args.detect_delay,
+                                    args.identities, args.face_delay))
+                detection.pool = match.pool = pool
+
+            if "detection" in selected:
+                run_stage(stages, "detection", bench_detection(corpora, engine, cache_key, sizes, args.processes),
+                          args.verbose, trace)
+                run_stage(stages, "detection.cached", bench_detection(corpora, engine, cache_key, sizes, args.processes),
+                          args.verbose, trace)
+            else:
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    bench_detection(corpora, engine, cache_key, sizes, args.processes)(Stage("detection"))
+
+            if "match" in selected:
+                if args.match_mode:
+                    match.match_mode = args.match_mode
+                seed_single(corpora, args.seeds, match.output_mode)
+                analyze = stub_analyzer(identity_centers(args.identities), match.sample_video, args.face_delay)
+                run_stage(stages, "match", bench_match(corpora, analyze, args.processes), args.verbose, trace)
+                # Embeddings come from the store now
+                run_stage(stages, "match.stored", bench_match(corpora, analyze, args.processes), args.verbose, trace)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    report(stages, baseline)
+
+    if args.output:
+        results = {
+            "args": vars(args),
+            "stages": {row.name: row.summary() for stage in stages for row in [stage, *stage.children]},
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults Saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import os
+import shutil
+from resultcache import file_digest
+
+def link_file(src, dst):
+    """Make dst the same file as src: a hardlink, a symlink across filesystems, a copy where neither works."""
+    tmp = dst + ".link"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        try:
+            os.symlink(os.path.abspath(src), tmp)
+        except OSError:
+            shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+class BlobStore:
+    """Downloaded media kept once under <root>/<sha256[:2]>/<sha256>.
+
+    Media folders hold links to the blobs, so a story that is also archived
+    in several highlights takes the space of one file, and a pk that is
+    already known is linked into a new folder instead of downloaded again.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, checksum):
+        return os.path.join(self.root, checksum[:2], checksum)
+
+    def has(self, checksum):
+        return bool(checksum) and os.path.exists(self.path(checksum))
+
+    def adopt(self, filename, checksum):
+        """Move a finished download into the store, leaving a link to the blob in its place."""
+        blob = self.path(checksum)
+        if os.path.exists(blob):
+            # Same bytes under another pk or path, keep the blob
+            link_file(blob, filename)
+            return
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(filename, blob)
+        except OSError:
+            shutil.copy2(filename, blob + ".tmp")
+            os.replace(blob + ".tmp", blob)
+            link_file(blob, filename)
+
+    def place(self, checksum, filename):
+        link_file(self.path(checksum), filename)
+
+def unique_paths(paths, digest=file_digest):
+    """paths without the ones whose content an earlier path already has, order kept.
+
+    Links to the same file are found by inode, copies by digest, which is
+    only computed for files sharing their size with another one. Paths that
+    can't be read are kept for the caller to report.
+    """
+    inodes = set()
+    candidates = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            candidates.append((path, None))
+            continue
+        inode = (stat.st_dev, stat.st_ino)
+        if inode not in inodes:
+            inodes.add(inode)
+            candidates.append((path, stat.st_size))
+
+    sizes = {}
+    for _, size in candidates:
+        sizes[size] = sizes.get(size, 0) + 1
+    seen = set()
+    unique = []
+    for path, size in candidates:
+        if size is not None and sizes[size] > 1:
+            key = digest(path)
+            if key in seen:
+                continue
+            seen.add(key)
+        unique.append(path)
+    return unique
+
+def preference(path):
+    """Sort key putting files outside highlight archives first, they keep the name when duplicates collapse.
+
+    Works on download paths (<user>/highlights/<title>/...) and on the
+    flattened names of the output folders (highlights_<title>_...).
+    """
+    archived = any(part.startswith("highlights") for part in os.path.normpath(path).split(os.sep))
+    return archived, path
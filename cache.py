@@ -0,0 +1,84 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+class MetadataCache:
+    """Persistent key/value store for slow-changing API results with per-entry TTL.
+
+    Values are stored as JSON. Expired entries are dropped on read and by purge(),
+    and the least recently used entries are evicted once max_entries is exceeded.
+    """
+
+    def __init__(self, path, ttl=86400, max_entries=10000):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+        self.purge()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+            self.conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires, now),
+            )
+            self.evict()
+            self.conn.commit()
+
+    def delete(self, key):
+        with self.lock:
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.conn.commit()
+
+    def cached(self, key, fetch, ttl=None):
+        """Return the cached value for key, calling fetch() and storing its result on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = fetch()
+            self.set(key, value, ttl)
+        return value
+
+    def evict(self):
+        count = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def purge(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM entries WHERE expires <= ?", (time.time(),))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,51 @@
+import os
+import sys
+import json
+import argparse
+
+MEDIA_TYPES = ("posts", "highlights", "stories", "reels")
+
+def load_targets(path="targets.json"):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def media_types(value):
+    """argparse type of --types, a comma separated subset of MEDIA_TYPES."""
+    types = [t.strip() for t in value.split(",") if t.strip()]
+    for t in types:
+        if t not in MEDIA_TYPES:
+            raise argparse.ArgumentTypeError(f"Unknown Media Type {t}, Expected One of {', '.join(MEDIA_TYPES)}")
+    return types
+
+def target_parser(description):
+    """Parser with the target arguments every script shares, the caller adds its own."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("targets", nargs="*", help="Usernames to process")
+    parser.add_argument("--all", action="store_true", help="Process every target of targets.json")
+    return parser
+
+def prompt_targets(targets, action):
+    """Interactive pick from targets.json, used when no target is given on the command line."""
+    print(f"Select a Target to {action}:")
+    print("0. All")
+    for idx, user in enumerate(targets, start=1):
+        print(f"{idx}. {user}")
+
+    choice = input("Enter the Number Correspondingly: ").strip()
+    if choice == "0":
+        return targets
+    try:
+        return [targets[int(choice) - 1]]
+    except (IndexError, ValueError):
+        print("Invalid Selection")
+        sys.exit(1)
+
+def selected_targets(args, action):
+    """Targets named by args, all of targets.json with --all, otherwise asked for interactively."""
+    if args.all:
+        return load_targets()
+    if args.targets:
+        return args.targets
+    return prompt_targets(load_targets(), action)
@@ -0,0 +1,144 @@
+import time
+import signal
+import threading
+from datetime import datetime
+import download
+from cli import MEDIA_TYPES, target_parser, media_types, load_targets
+
+config = download.config
+min_interval = config.get("daemon_min_interval", 1800)
+max_interval = config.get("daemon_max_interval", 259200)
+default_interval = config.get("daemon_default_interval", 21600)
+# Poll this many times per expected gap between two posts
+poll_factor = config.get("daemon_poll_factor", 0.5)
+# Every poll that finds nothing stretches the interval by this factor
+idle_backoff = config.get("daemon_idle_backoff", 1.5)
+history = config.get("daemon_history", 10)
+# Stories expire after 24 hours, polling at least this often sees every one of them
+story_window = config.get("story_window", 72000)
+reload_interval = config.get("daemon_reload_interval", 300)
+
+stop = threading.Event()
+
+def posting_gap(target, media_type):
+    """Expected seconds between two new media of a target, None before anything was downloaded.
+
+    The mean gap between the newest few media, stretched to the time since
+    the newest one when the target has gone quiet for longer than that.
+    """
+    taken = download.manifest.recent_taken_at(target, media_type, history)
+    if not taken:
+        return None
+    now = datetime.now(taken[0].tzinfo)
+    since_newest = (now - taken[0]).total_seconds()
+    if len(taken) < 2:
+        return since_newest
+    mean_gap = (taken[0] - taken[-1]).total_seconds() / (len(taken) - 1)
+    return max(mean_gap, since_newest)
+
+def next_interval(target, media_type, idle):
+    gap = posting_gap(target, media_type)
+    interval = default_interval if gap is None else gap * poll_factor
+    interval *= idle_backoff ** idle
+    interval = min(max(interval, min_interval), max_interval)
+    if media_type == "stories":
+        interval = min(interval, story_window)
+    return interval
+
+def due(targets, types):
+    """(next_poll, target, media_type) of every job, soonest first, stories first among equals.
+
+    A job never polled is due now.
+    """
+    jobs = []
+    for target in targets:
+        for media_type in types:
+            state = download.manifest.get_schedule(target, media_type)
+            jobs.append((state["next_poll"] if state else 0.0, media_type != "stories", target, media_type))
+    jobs.sort()
+    return [(when, target, media_type) for when, _, target, media_type in jobs]
+
+def poll(target, media_type):
+    state = download.manifest.get_schedule(target, media_type) or {"idle": 0}
+    queued = download.downloader.queued
+    started = time.time()
+    try:
+        with download.metrics.timer("daemon_poll_seconds", media_type=media_type):
+            download.DOWNLOADS[media_type](target)
+    except Exception as e:
+        print(f"Polling {media_type.title()} of {target} Failed: {e}")
+        download.metrics.inc("daemon_polls_total", media_type=media_type, result="error")
+        # Retry at the shortest interval, the session may just need a refresh
+        download.manifest.set_schedule(target, media_type, started + min_interval, started, min_interval, state["idle"])
+        revalidate()
+        return
+
+    found = download.downloader.queued - queued
+    idle = 0 if found else state["idle"] + 1
+    interval = next_interval(target, media_type, idle)
+    download.manifest.set_schedule(target, media_type, started + interval, started, interval, idle)
+    download.metrics.inc("daemon_polls_total", media_type=media_type, result="new" if found else "idle")
+    download.metrics.inc("daemon_new_media_total", found, media_type=media_type)
+    print(f"Polled {media_type.title()} of {target}: {found} New, Next in {interval / 3600:.1f} Hours")
+
+def revalidate():
+    download.cache.delete(f"session:{download.username}")
+    try:
+        download.login()
+    except Exception as e:
+        print(f"Failed to Refresh Session: {e}")
+
+def run(targets, types):
+    """Poll targets until SIGINT/SIGTERM, always the job that is due soonest.
+
+    Without targets, targets.json is read again every reload_interval so
+    edits apply without a restart.
+    """
+    previous = None
+    while not stop.is_set():
+        jobs = due(targets or load_targets(download.json_file), types)
+        if not jobs:
+            print("No Targets to Poll")
+            stop.wait(reload_interval)
+            continue
+
+        when, target, media_type = jobs[0]
+        delay = when - time.time()
+        if delay > 0:
+            retried = download.downloader.retry_failed()
+            if retried:
+                print(f"Retrying {retried} Failed Downloads")
+            print(f"Next Poll: {media_type.title()} of {target} in {delay / 60:.0f} Minutes")
+            download.metrics.flush()
+            stop.wait(min(delay, reload_interval))
+            continue
+
+        if previous is not None and previous != target:
+            download.scheduler.next_target()
+        previous = target
+        poll(target, media_type)
+
+def main():
+    parser = target_parser("Keep downloading targets, polling each as often as it posts.")
+    parser.add_argument("--types", type=media_types, default=list(MEDIA_TYPES),
+                        help="Comma separated media types (default: posts,highlights,stories,reels)")
+    args = parser.parse_args()
+
+    download.login()
+    download.exit_on_error = False
+
+    def shutdown(signum, frame):
+        print("Stopping After the Current Poll")
+        stop.set()
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    if download.webhook:
+        download.notify("Daemon Started")
+    run(None if args.all else args.targets, args.types)
+    download.finish_downloads()
+    if download.webhook:
+        download.notify("Daemon Stopped")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,16 @@
 import os
 import json
-import shutil
-from ultralytics import YOLO
+import threading
+from inference import InferenceEngine, extract_boxes
+from layout import OutputLayout, user_lock
+from resultcache import ResultCache, model_key
+from video import video_extensions, sampler, sampling_key
+from metrics import Metrics
+from cli import target_parser, selected_targets
+from worker import connect, WorkerError
+from blobs import unique_paths, preference
+from neardup import HashCache, group, ratio, copy_key
+from shards import create_pool, run_chunks, for_each, serialized
 
 with open("config.json", "r", encoding="utf-8") as f:
     config = json.load(f)
@@ -9,71 +18,318 @@ with open("config.json", "r", encoding="utf-8") as f:
 model_path = config.get("model_path")
 threshold = config.get("threshold")
 target_class = config.get("target_class")
+output_mode = config.get("output_mode", "copy")
+device = config.get("device", "cuda")
+backend = config.get("backend", "torch")
+imgsz = config.get("imgsz", 640)
+# Boxes below this are never stored, a lower threshold needs a lower floor
+conf_floor = min(config.get("conf_floor", 0.25), threshold)
+# NMS overlap of match.py's person test, it doesn't change whether an image is detected
+iou = config.get("iou", 0.45)
+# Images whose perceptual hashes are this close are detected once, "" turns the grouping off
+hash_kind = config.get("near_duplicate_hash", "phash")
+hash_distance = config.get("near_duplicate_distance", 4)
 
-with open("targets.json", "r", encoding="utf-8") as f:
-    targets = json.load(f)
+# Built by main(), or set up by whoever imports the functions below
+cache = None
+video_cache = None
+hashes = None
+metrics = Metrics("detection")
+# Loaded by get_engine() once an image actually needs it
+engine = None
+# The targets main() runs side by side share engine, it is loaded and run by one at a time
+model_lock = threading.RLock()
+# Connection to worker.py, which runs the model instead when it's up
+worker = None
+worker_batch = config.get("worker_batch", 64)
+# Process pool of main() --processes, each process loads the model once
+pool = None
+shard_threads = config.get("shard_threads", 1)
+shard_chunk = config.get("shard_chunk", 32)
 
-model = YOLO(model_path)
-model.to("cuda")
+image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
 
-print("Select a Target to Detect:")
-print("0. All")
-for idx, user in enumerate(targets, start=1):
-    print(f"{idx}. {user}")
+def output_name(image_path, input_folder):
+    rel_path = os.path.relpath(os.path.dirname(image_path), input_folder)
+    prefix = rel_path.replace(os.sep, "_") if rel_path not in (".", "") else ""
+    basename = os.path.basename(image_path)
+    return f"{prefix}_{basename}" if prefix else basename
 
-choice = input("Enter the Number Correspondingly: ").strip()
-if choice == "0":
-    selected_users = targets
-else:
-    try:
-        selected_users = [targets[int(choice) - 1]]
-    except (IndexError, ValueError):
-        print("Invalid Selection")
-        exit(1)
+def collapse(paths, kind):
+    """paths with every duplicate dropped, links to one blob and copies of the same media are detected once."""
+    unique = unique_paths(sorted(paths, key=preference), cache.digest)
+    if len(unique) < len(paths):
+        print(f"Collapsed {len(paths) - len(unique)} Duplicate {kind.title()}s")
+        metrics.inc("detection_duplicates_total", len(paths) - len(unique), kind=kind)
+    return unique
 
-image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+def near_duplicates(paths):
+    """(groups, hashes) of the images to detect, only the representative of each group goes to the model."""
+    if hashes is None:
+        return {path: [] for path in paths}, {}
+    found = hashes.hashes(paths)
+    groups = group(paths, found, hash_distance)
+    members = len(paths) - len(groups)
+    if members:
+        print(f"Grouped {members} Near-Duplicate Images, Detecting {len(groups)}")
+        metrics.inc("detection_near_duplicates_total", members)
+    return groups, found
+
+def copied_key():
+    """Cache variant of boxes scaled from a near-duplicate, None while grouping is off."""
+    return None if hashes is None else copy_key(hashes.kind, hash_distance)
+
+def scaled_boxes(boxes, found, source, target):
+    sx, sy = ratio(found, source, target)
+    return [[name, conf, round(x1 * sx, 1), round(y1 * sy, 1), round(x2 * sx, 1), round(y2 * sy, 1)]
+            for name, conf, x1, y1, x2, y2 in boxes]
+
+def load_index(index_path):
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_index(index_path, index):
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+
+def persons(boxes):
+    # Person boxes for match.py, [score, x1, y1, x2, y2]
+    return [box[1:] for box in boxes if box[0] == "person"]
 
-def detection(image_path, root, input_folder, detected_dir, missed_dir):
+def detection(image_path, boxes, input_folder, layout, index, frames=None):
+    """Classify an image by its boxes, or a video by the boxes of all its frames ([frame_index, boxes] rows)."""
     try:
-        results = model(image_path)[0]
+        if frames is not None:
+            boxes = [box for _, frame_boxes in frames for box in frame_boxes]
+        if boxes is None:
+            raise ValueError("Unreadable Image")
         detected = False
 
-        for box in results.boxes:
-            cls = int(box.cls)
-            conf = float(box.conf)
-            if results.names[cls] == target_class and conf > threshold:
-                rel_path = os.path.relpath(root, input_folder)
-                prefix = rel_path.replace(os.sep, "_") if rel_path not in (".", "") else ""
-                basename = os.path.basename(image_path)
-                new_filename = f"{prefix}_{basename}" if prefix else basename
-                detected_path = os.path.join(detected_dir, new_filename)
-                shutil.copy2(image_path, detected_path)
+        for name, conf, *_ in boxes:
+            if name == target_class and conf > threshold:
                 detected = True
                 break
 
-        if not detected:
-            rel_path = os.path.relpath(root, input_folder)
-            prefix = rel_path.replace(os.sep, "_") if rel_path not in (".", "") else ""
-            basename = os.path.basename(image_path)
-            new_filename = f"{prefix}_{basename}" if prefix else basename
-            missed_path = os.path.join(missed_dir, new_filename)
-            shutil.copy2(image_path, missed_path)
+        category = "detected" if detected else "missed"
+        metrics.inc("detection_files_total", category=category)
+        name = output_name(image_path, input_folder)
+        layout.place(image_path, category, name)
+        if frames is not None:
+            index[name] = {"frames": [[frame_index, persons(frame_boxes)] for frame_index, frame_boxes in frames]}
+        else:
+            index[name] = persons(boxes)
 
     except Exception as e:
         print(f"Skipped {os.path.basename(image_path)} Due to Error: {e}")
+        metrics.inc("detection_files_total", category="skipped")
+
+def get_engine():
+    global engine
+    with model_lock:
+        if engine is None:
+            engine = InferenceEngine(
+                model_path,
+                device=device,
+                backend=backend,
+                batch_size=config.get("batch_size", 16),
+                imgsz=imgsz,
+                conf=conf_floor,
+                iou=iou,
+                decode_workers=config.get("decode_workers", 4),
+                metrics=metrics,
+            )
+    return engine
+
+def connect_worker():
+    """Use worker.py when it runs the same model and sampling as this run would."""
+    global worker
+    worker = connect(config.get("worker_socket"))
+    if worker is None:
+        return
+    if worker.info["detect_key"] != cache.key or worker.info["sampling_key"] != sampling_key(config):
+        print("Inference Worker Runs Another Model or Sampling, Running Locally")
+        worker.close()
+        worker = None
+        return
+    print(f"Using Inference Worker (PID {worker.info['pid']})")
+
+def remote(call, paths):
+    """Yield the results of worker call for paths in chunks, None once the worker went away."""
+    global worker
+    for i in range(0, len(paths), worker_batch):
+        try:
+            yield from call(paths[i:i + worker_batch])
+        except (OSError, EOFError, WorkerError) as e:
+            print(f"Inference Worker Failed ({e}), Running Locally")
+            worker = None
+            yield None
+            return
+
+def init_shard(shard_device):
+    """Set up a pool process, the model is loaded once and serves every chunk it gets."""
+    global device
+    device = shard_device
+    get_engine()
+
+def detect_chunk(paths):
+    """[(path, boxes)] of images by this process's engine, what worker.py and the pool run."""
+    return [(image_path, extract_boxes(results) if results is not None else None)
+            for image_path, results in get_engine().run(paths)]
+
+def detect_video_chunk(paths):
+    videos = []
+    for video_path, results in get_engine().run_videos(paths, sampler(config)):
+        frames = None if results is None else [[frame_index, extract_boxes(result)] for frame_index, result in results]
+        videos.append((video_path, frames))
+    return videos
+
+def detect_images(paths):
+    """Yield (path, boxes) for every path, boxes is None for unreadable images."""
+    done = 0
+    if worker is not None:
+        for item in remote(worker.detect, paths):
+            if item is None:
+                break
+            done += 1
+            yield item
+    if pool is not None and done < len(paths):
+        yield from run_chunks(pool, detect_chunk, paths[done:], shard_chunk, serialized(detect_chunk, model_lock))
+        return
+    if done < len(paths):
+        for image_path, results in get_engine().run(paths[done:]):
+            yield image_path, extract_boxes(results) if results is not None else None
 
-for user in selected_users:
+def detect_videos(paths):
+    """Yield (path, [[frame_index, boxes]]) for every video, None when it can't be decoded."""
+    done = 0
+    if worker is not None:
+        for item in remote(worker.detect_videos, paths):
+            if item is None:
+                break
+            done += 1
+            yield item
+    if pool is not None and done < len(paths):
+        # One video per chunk, each is a batch of frames already
+        yield from run_chunks(pool, detect_video_chunk, paths[done:], 1, serialized(detect_video_chunk, model_lock))
+        return
+    if done < len(paths):
+        for video_path, results in get_engine().run_videos(paths[done:], sampler(config)):
+            if results is None:
+                yield video_path, None
+            else:
+                yield video_path, [[frame_index, extract_boxes(result)] for frame_index, result in results]
+
+def detect_user(user):
     input_folder = os.path.abspath(os.path.join("data", user))
     print(f"\nProcessing Folder: {input_folder}")
 
-    output_base = os.path.abspath("output")
-    detected_dir = os.path.join(output_base, user, "detected")
-    missed_dir = os.path.join(output_base, user, "missed")
-    os.makedirs(detected_dir, exist_ok=True)
-    os.makedirs(missed_dir, exist_ok=True)
-
+    image_paths = []
+    video_paths = []
     for root, _, files in os.walk(input_folder):
         for filename in files:
             if filename.lower().endswith(image_extensions):
-                image_path = os.path.join(root, filename)
-                detection(image_path, root, input_folder, detected_dir, missed_dir)
+                image_paths.append(os.path.join(root, filename))
+            elif filename.lower().endswith(video_extensions):
+                video_paths.append(os.path.join(root, filename))
+    detect_files(user, image_paths, video_paths)
+
+def detect_files(user, image_paths, video_paths):
+    """Sort files of data/<user> into the user's output, the whole folder or only the new files of stream.py."""
+    input_folder = os.path.abspath(os.path.join("data", user))
+    layout = OutputLayout(os.path.join(os.path.abspath("output"), user), output_mode)
+    layout.create("detected", "missed")
+    index_path = os.path.join(layout.user_dir, "detections.json")
+    index = load_index(index_path)
+
+    image_paths = collapse(image_paths, "image")
+    video_paths = collapse(video_paths, "video")
+
+    pending = []
+    for image_path in image_paths:
+        boxes = cache.get(image_path)
+        if boxes is None and hashes is not None:
+            boxes = cache.get(image_path, copied_key())
+        if boxes is None:
+            pending.append(image_path)
+        else:
+            detection(image_path, boxes, input_folder, layout, index)
+    print(f"{len(image_paths) - len(pending)} Images Classified from Cache, {len(pending)} to Detect")
+    metrics.inc("detection_cache_total", len(image_paths) - len(pending), kind="image", result="hit")
+    metrics.inc("detection_cache_total", len(pending), kind="image", result="miss")
+
+    groups, found = near_duplicates(pending)
+    for image_path, boxes in detect_images(list(groups)):
+        if boxes is not None:
+            cache.put(image_path, boxes)
+        detection(image_path, boxes, input_folder, layout, index)
+        for member in groups[image_path]:
+            member_boxes = None if boxes is None else scaled_boxes(boxes, found, image_path, member)
+            if member_boxes is not None:
+                # Kept apart from the model's own results, turning grouping off or changing it detects the member
+                cache.put(member, member_boxes, copied_key())
+            detection(member, member_boxes, input_folder, layout, index)
+
+    pending = []
+    for video_path in video_paths:
+        frames = video_cache.get(video_path)
+        if frames is None:
+            pending.append(video_path)
+        else:
+            detection(video_path, None, input_folder, layout, index, frames=frames)
+    print(f"{len(video_paths) - len(pending)} Videos Classified from Cache, {len(pending)} to Detect")
+    metrics.inc("detection_cache_total", len(video_paths) - len(pending), kind="video", result="hit")
+    metrics.inc("detection_cache_total", len(pending), kind="video", result="miss")
+
+    for video_path, frames in detect_videos(pending):
+        if frames is None:
+            print(f"Skipped {os.path.basename(video_path)} Due to Error: Unreadable Video")
+            continue
+        video_cache.put(video_path, frames)
+        detection(video_path, None, input_folder, layout, index, frames=frames)
+    layout.save()
+    save_index(index_path, index)
+
+def main():
+    global device, cache, video_cache, hashes, metrics, pool
+    parser = target_parser("Sort downloaded media of targets into detected and missed.")
+    parser.add_argument("--device", help="Override device of config.json, e.g. cpu or cuda:1")
+    parser.add_argument("--processes", type=int, default=config.get("shard_processes", 0),
+                        help="Run the model in this many processes and that many targets at once")
+    args = parser.parse_args()
+    selected_users = selected_targets(args, "Detect")
+
+    metrics = Metrics.from_config("detection", config)
+    device = args.device or device
+    cache = ResultCache(os.path.join("output", "detection_cache.db"), model_key(model_path, backend, imgsz, conf_floor, iou))
+    # Video results also depend on which frames were sampled
+    video_cache = ResultCache(os.path.join("output", "detection_cache.db"), f"{cache.key}|{sampling_key(config)}")
+    if hash_kind:
+        hashes = HashCache(os.path.join("output", "hashes.db"), hash_kind)
+    connect_worker()
+    if worker is None and args.processes > 1:
+        print(f"Detecting in {args.processes} Processes")
+        pool = create_pool(args.processes, shard_threads, init_shard, (device,))
+
+    def run(user):
+        with user_lock(os.path.join("output", user)), metrics.timer("detection_user_seconds", user=user):
+            detect_user(user)
+    # Every target places its own results in its own order, so they can run side by side
+    for_each(run, selected_users, args.processes if pool is not None else 1)
+
+    if pool is not None:
+        pool.shutdown()
+
+    cache.close()
+    video_cache.close()
+    if hashes is not None:
+        hashes.close()
+    if worker is not None:
+        worker.close()
+    metrics.finish(config.get("metrics_notify", False))
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,22 @@
 import os
 import json
 import requests
-import time
-import random
 import unicodedata
 import sys
 from dotenv import load_dotenv
 from instagrapi import Client
+from instagrapi import config as instagrapi_config
+from instagrapi.extractors import extract_highlight_v1
+from instagrapi.types import Highlight
 from datetime import datetime
+from downloader import Downloader
+from manifest import Manifest
+from cache import MetadataCache
+from blobs import BlobStore, link_file
+from inbox import Inbox
+from scheduler import Scheduler
+from metrics import Metrics
+from cli import MEDIA_TYPES, target_parser, media_types, load_targets
 
 load_dotenv()
 username = os.getenv("username")
@@ -15,10 +24,64 @@ password = os.getenv("password")
 webhook = os.getenv("webhook")
 session_file = "session.json"
 json_file = "targets.json"
+data_dir = os.path.join(os.path.dirname(__file__), "data")
+
+with open("config.json", "r", encoding="utf-8") as f:
+    config = json.load(f)
+
+known_media_stop = config.get("known_media_stop", 4)
+page_size = config.get("page_size", 33)
+user_id_ttl = config.get("user_id_ttl", 604800)
+highlights_ttl = config.get("highlights_ttl", 21600)
+# Highlight reels fetched per feed/reels_media/ request, 1 asks for each one with highlight_info
+highlight_batch = config.get("highlight_batch", 10)
+highlight_items_ttl = config.get("highlight_items_ttl", 2592000)
+session_ttl = config.get("session_ttl", 3600)
 
 cl = Client()
 cl.delay_range = [0, 5]
 
+metrics = Metrics.from_config("download", config)
+
+scheduler = Scheduler(
+    api_delay=(config.get("api_delay_min", 15), config.get("api_delay_max", 30)),
+    target_delay=(config.get("target_delay_min", 50), config.get("target_delay_max", 70)),
+    cdn_rate_limit=config.get("cdn_rate_limit", 0),
+    log_path=config.get("scheduler_log"),
+    metrics=metrics,
+)
+
+manifest = Manifest(os.path.join(data_dir, "manifest.db"))
+cache = MetadataCache(
+    os.path.join(data_dir, "cache.db"),
+    max_entries=config.get("cache_max_entries", 10000),
+)
+# Empty blob_store keeps every download a plain file in its media folder
+blob_dir = config.get("blob_store", "data/.blobs")
+blobs = BlobStore(os.path.join(os.path.dirname(__file__), blob_dir)) if blob_dir else None
+# With stream_queue, stream.py detects and embeds every file as soon as it is downloaded
+stream_queue = config.get("stream_queue")
+inbox = Inbox(os.path.join(os.path.dirname(__file__), stream_queue)) if stream_queue else None
+
+def create_downloader():
+    return Downloader(
+        workers=config.get("download_workers", 4),
+        max_pending=config.get("download_max_pending", 32),
+        chunk_size=config.get("download_chunk_size", 1 << 20),
+        buffer_size=config.get("download_buffer_size", 1 << 20),
+        manifest=manifest,
+        scheduler=scheduler,
+        retries=config.get("download_retries", 3),
+        backoff=config.get("download_backoff", 2.0),
+        retry_rounds=config.get("download_retry_rounds", 1),
+        retry_delay=config.get("download_retry_delay", 30),
+        metrics=metrics,
+        blobs=blobs,
+        inbox=inbox,
+    )
+
+downloader = create_downloader()
+
 def notify(msg):
     data = {
         "content": msg
@@ -30,59 +93,234 @@ def notify(msg):
     except Exception as e:
         print(f"Failed to Send Discord Notification: {e}")
 
+class TargetError(Exception):
+    pass
+
+# daemon.py carries on with the next target instead of exiting
+exit_on_error = True
+
 def termination():
+    if not exit_on_error:
+        raise TargetError("Listing Failed")
     if webhook:
         notify("Program Stopped")
     sys.exit(1)
 
-def safe_delay(min_s=15, max_s=30):
-    delay = random.uniform(min_s, max_s)
-    print(f"Safe Delay: {delay:.2f} Seconds")
-    time.sleep(delay)
+def session_valid():
+    key = f"session:{username}"
+    if cache.get(key):
+        return True
+    try:
+        scheduler.api(cl.account_info)
+    except Exception as e:
+        print(f"Saved Session Invalid: {e}")
+        return False
+    cache.set(key, True, session_ttl)
+    return True
 
 def login():
     if os.path.exists(session_file):
         try:
             cl.load_settings(session_file)
-            cl.login(username, password)
-            print("Session Loaded Successfully")
+            if session_valid():
+                print("Session Loaded Successfully")
+                return
+            scheduler.api(cl.login, username, password)
+            cl.dump_settings(session_file)
+            cache.set(f"session:{username}", True, session_ttl)
+            print("Session Refreshed and Saved")
             return
         except Exception as e:
             print(f"Failed to Load Session: {e}")
             termination()
     else:
         try:
-            cl.login(username, password)
+            scheduler.api(cl.login, username, password)
             cl.dump_settings(session_file)
             print("Logged in and Session Saved")
         except Exception as e:
             print(f"Failed to Login: {e}")
             termination()
 
-def should_skip_file(filename):
+def resolve_user_id(target):
+    return cache.cached(f"user_id:{target}", lambda: scheduler.api(cl.user_id_from_username, target), user_id_ttl)
+
+def fetch_highlights(user_id):
+    highlights = cache.cached(
+        f"highlights:{user_id}",
+        lambda: [h.model_dump(mode="json") for h in scheduler.api(cl.user_highlights, user_id)],
+        highlights_ttl,
+    )
+    return [Highlight.model_validate(h) for h in highlights]
+
+def reels_media(reel_ids):
+    """Raw reels of several highlights in one request, the call highlight_info makes for a single one."""
+    data = {
+        "exclude_media_ids": "[]",
+        "supported_capabilities_new": json.dumps(instagrapi_config.SUPPORTED_CAPABILITIES),
+        "source": "profile",
+        "_uid": str(cl.user_id),
+        "_uuid": cl.uuid,
+        "user_ids": reel_ids,
+    }
+    return cl.private_request("feed/reels_media/", data).get("reels", {})
+
+def fetch_highlight_items(highlights):
+    """{highlight id: items} of highlights, highlight_batch of them per request."""
+    if highlight_batch <= 1:
+        return {h.id: scheduler.api(cl.highlight_info, h.id.split(":")[-1]).items for h in highlights}
+    items = {}
+    for i in range(0, len(highlights), highlight_batch):
+        reels = scheduler.api(reels_media, [h.id for h in highlights[i:i + highlight_batch]])
+        for reel_id, reel in reels.items():
+            items[reel_id] = extract_highlight_v1(reel).items
+    return items
+
+def highlight_unchanged(highlight):
+    """Whether nothing was added to a highlight since all of its items were downloaded.
+
+    The pks of its items are cached with its latest_reel_media, which the
+    highlights tray reports without fetching the items.
+    """
+    if not highlight.latest_reel_media:
+        return False
+    known = cache.get(f"highlight_items:{highlight.id}")
+    if not known or known["latest_reel_media"] != highlight.latest_reel_media:
+        return False
+    return all(manifest.has(pk, path) for pk, path in known["items"])
+
+def remember_highlight(highlight, items):
+    cache.set(f"highlight_items:{highlight.id}",
+              {"latest_reel_media": highlight.latest_reel_media, "items": items}, highlight_items_ttl)
+
+def should_skip_file(filename, record=None):
+    if record and manifest.has(record["pk"], filename):
+        print(f"Skipped (Already Downloaded): {filename}")
+        metrics.inc("downloads_skipped_total", reason="known")
+        return True
     if os.path.exists(filename):
+        # Downloaded before the manifest existed, adopt the file for this pk
+        if record:
+            manifest.record(path=filename, size=os.path.getsize(filename), **record)
         print(f"Skipped (Already Exists): {filename}")
+        metrics.inc("downloads_skipped_total", reason="exists")
+        return True
+    if record and link_known(filename, record):
+        metrics.inc("downloads_skipped_total", reason="linked")
         return True
     return False
 
-def download_file(url, filename, use_headers=False):
-    if not url:
-        print(f"Skipping Download, URL is None for {filename}")
-        return
-    try:
-        headers = {
-            "User-Agent": "Mozilla/5.0"
-        } if use_headers else {}
+def link_known(filename, record):
+    """Link a pk downloaded before under another path (a story archived in a highlight) instead of fetching it again."""
+    for path, size, checksum in manifest.find(record["pk"]):
+        if blobs and blobs.has(checksum):
+            blobs.place(checksum, filename)
+        elif os.path.exists(path):
+            link_file(path, filename)
+        else:
+            continue
+        manifest.record(path=filename, size=size, checksum=checksum, **record)
+        print(f"Skipped (Linked to {path}): {filename}")
+        return True
+    return False
 
-        response = requests.get(url, stream=True, headers=headers)
-        response.raise_for_status()
-        with open(filename, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        print(f"Downloaded: {filename}")
-    except Exception as e:
-        print(f"Error Downloading {filename}: {e}")
-        termination()
+def media_record(media, target, media_type):
+    return {"pk": media.pk, "target": target, "media_type": media_type, "taken_at": media.taken_at}
+
+def is_known(media):
+    if media.media_type == 8 and media.resources:
+        return all(manifest.has(resource.pk) for resource in media.resources)
+    return manifest.has(media.pk)
+
+def iter_pages(fetch_page, user_id, end_cursor="", may_be_empty=True):
+    """Yield one page of media at a time with the cursor of the page after it.
+
+    instagrapi answers a failed page request with no media and a None cursor
+    instead of raising, the end of a listing has an empty cursor. That ends
+    the run like any other listing error, before the checkpoint or the
+    watermark move. Only the first page of an account that may_be_empty
+    (never listed before) is taken as having nothing.
+    """
+    first = True
+    while True:
+        medias, end_cursor = scheduler.api(fetch_page, user_id, page_size, end_cursor=end_cursor)
+        if not medias and end_cursor is None and not (first and may_be_empty):
+            print("Listing Page Failed, Keeping the Checkpoint for the Next Run")
+            termination()
+        first = False
+        yield medias, end_cursor
+        if not medias or not end_cursor:
+            return
+
+def iter_medias(fetch_page, user_id, target, media_type, skip=None):
+    """Yield a user's media newest first, one page in memory at a time.
+
+    A run of known_media_stop already-downloaded media ends the listing once a
+    previous listing completed (only media older than the watermark count, a
+    few pinned posts may precede new ones) and every pending download of the
+    target has come up again. The cursor of every processed page is
+    checkpointed, so a listing interrupted part way resumes from there after
+    first picking up whatever was posted since.
+    """
+    watermark = manifest.get_watermark(target, media_type)
+    checkpoint = manifest.get_cursor(target, media_type)
+    pending = manifest.pending(target, media_type)
+    newest = None
+    passes = [("", True)]
+    if checkpoint:
+        print(f"Resuming {media_type.title()} Listing for {target} After New Media")
+        passes.append((checkpoint, False))
+
+    for start, head in passes:
+        streak = 0
+        for medias, end_cursor in iter_pages(fetch_page, user_id, start, not (watermark or checkpoint)):
+            stopped = False
+            for media in medias:
+                if skip and skip(media):
+                    continue
+                if newest is None or media.taken_at > newest.taken_at:
+                    newest = media
+                if pending:
+                    pending.difference_update([str(media.pk)] + [str(resource.pk) for resource in media.resources or ()])
+                if is_known(media):
+                    if head and not pending and (checkpoint or watermark) and (not watermark or media.taken_at <= watermark[1]):
+                        streak += 1
+                        if streak >= known_media_stop:
+                            stopped = True
+                            break
+                    continue
+                streak = 0
+                yield media
+            del medias
+            if stopped:
+                print(f"Reached Known {media_type.title()} for {target}, Stopping Listing")
+                break
+            # Everything up to here is queued, a restart can continue after this page
+            if not (head and checkpoint):
+                manifest.set_cursor(target, media_type, end_cursor)
+        else:
+            # Reached the end of the listing, nothing left to resume
+            break
+
+    if pending:
+        # Listed to the end without them, deleted since they were queued
+        manifest.drop_pending(target, media_type, pending)
+    manifest.set_cursor(target, media_type, None)
+    if newest and (not watermark or newest.taken_at > watermark[1]):
+        manifest.set_watermark(target, media_type, newest.pk, newest.taken_at)
+
+def finish_downloads():
+    failed = downloader.close()
+    print(f"Scheduler: {scheduler.summary()}")
+    manifest.close()
+    cache.close()
+    if failed:
+        print(f"{len(failed)} Downloads Failed, Kept for Next Run:")
+        for url, filename, _, _ in failed:
+            print(f"  {filename}")
+        if webhook:
+            notify(f"{len(failed)} Downloads Failed")
+    metrics.finish(config.get("metrics_notify", False))
 
 def sanitize_filename(name):
     result = []
@@ -98,10 +336,9 @@ def sanitize_filename(name):
     return "".join(result).strip()
 
 def download_highlights(username):
-    user_id = cl.user_id_from_username(username)
-    safe_delay()
+    user_id = resolve_user_id(username)
     try:
-        highlights = cl.user_highlights(user_id)
+        highlights = fetch_highlights(user_id)
         print(f"Fetched {len(highlights)} Highlights")
         if not highlights:
             print("No Highlights Found")
@@ -110,86 +347,101 @@ def download_highlights(username):
         print(f"Error Fetching Highlights for {username}: {e}")
         termination()
 
-    base_folder = os.path.join(os.path.dirname(__file__), "data", username, "highlights")
+    base_folder = os.path.join(data_dir, username, "highlights")
     os.makedirs(base_folder, exist_ok=True)
 
+    folders = {}
+    changed = []
     for index, highlight in enumerate(highlights):
         highlight_name = highlight.title.strip() if highlight.title else f"highlight_{index+1}"
         highlight_name = sanitize_filename(highlight_name)
-        highlight_folder = os.path.join(base_folder, highlight_name)
+        folders[highlight.id] = os.path.join(base_folder, highlight_name)
+        if highlight_unchanged(highlight):
+            metrics.inc("highlights_unchanged_total")
+        else:
+            changed.append(highlight)
+    print(f"{len(highlights) - len(changed)} Highlights Unchanged, {len(changed)} to Fetch")
+
+    try:
+        highlight_items = fetch_highlight_items(changed)
+    except Exception as e:
+        print(f"Error Fetching Stories of Highlights for {username}: {e}")
+        termination()
+
+    for highlight in changed:
+        highlight_folder = folders[highlight.id]
         os.makedirs(highlight_folder, exist_ok=True)
 
         print(f"\nProcessing Highlight: {highlight.title} ({highlight.id})")
-        highlight_id_numeric = highlight.id.split(":")[-1]
-
-        try:
-            highlight_items = cl.highlight_info(highlight_id_numeric).items
-            print(f"Highlight {highlight.id} Contains {len(highlight_items)} Stories")
-        except Exception as e:
-            print(f"Error Fetching Stories for Highlight {highlight.id}: {e}")
-            termination()
+        if highlight.id not in highlight_items:
+            print(f"Highlight {highlight.id} Not Returned, Skipped")
+            continue
+        print(f"Highlight {highlight.id} Contains {len(highlight_items[highlight.id])} Stories")
 
-        for i, item in enumerate(highlight_items):
+        items = []
+        for i, item in enumerate(highlight_items[highlight.id]):
             timestamp = item.taken_at.strftime("%Y-%m-%d_%H-%M-%S")
             media_url = item.video_url if item.video_url else item.thumbnail_url
             ext = ".mp4" if item.video_url else ".jpg"
-            filename = os.path.join(highlight_folder, f"{timestamp}{ext}")
+            filename = manifest.resolve_path(highlight_folder, timestamp, ext, item.pk)
+            record = media_record(item, username, "highlights")
+            if not media_url:
+                continue
+            items.append((str(item.pk), filename))
 
-            if not media_url or should_skip_file(filename):
+            if should_skip_file(filename, record):
                 continue
 
-            download_file(media_url, filename, use_headers=True)
-            safe_delay()
+            downloader.submit(media_url, filename, use_headers=True, record=record)
+        # Checked against the manifest next time, a failed download makes the highlight count as changed
+        remember_highlight(highlight, items)
 
 def download_posts(username):
-    save_folder = os.path.join(os.path.dirname(__file__), "data", username, "posts")
-    safe_delay()
-    user_id = cl.user_id_from_username(username)
-    safe_delay()
+    save_folder = os.path.join(data_dir, username, "posts")
+    user_id = resolve_user_id(username)
+
+    os.makedirs(save_folder, exist_ok=True)
+    posts = iter_medias(cl.user_medias_paginated, user_id, username, "posts", skip=lambda m: m.media_type == 2)
+    count = 0
 
     try:
-        posts = [m for m in cl.user_medias(user_id) if m.media_type != 2]
+        for post in posts:
+            count += 1
+            timestamp = post.taken_at.strftime("%Y-%m-%d_%H-%M-%S")
+
+            if post.media_type == 1:
+                media_url = post.thumbnail_url or post.image_versions2['candidates'][0]['url']
+                ext = ".jpg"
+                filename = manifest.resolve_path(save_folder, timestamp, ext, post.pk)
+                record = media_record(post, username, "posts")
+                if should_skip_file(filename, record):
+                    continue
+                downloader.submit(media_url, filename, record=record)
+
+            elif post.media_type == 8:
+                for media_index, resource in enumerate(post.resources, start=1):
+                    taken_at = getattr(resource, "taken_at", post.taken_at)
+                    timestamp = taken_at.strftime("%Y-%m-%d_%H-%M-%S")
+                    ext = ".mp4" if resource.video_url else ".jpg"
+                    media_url = resource.video_url if ext == ".mp4" else resource.thumbnail_url
+                    filename = manifest.resolve_path(save_folder, f"{timestamp}_{media_index}", ext, resource.pk)
+                    record = {"pk": resource.pk, "target": username, "media_type": "posts", "taken_at": taken_at}
+                    if should_skip_file(filename, record):
+                        continue
+                    downloader.submit(media_url, filename, record=record)
     except KeyError as e:
         print(f"KeyError Encountered: {e}")
-        posts = []
-
-    if not posts:
-        print(f"No Posts Found for {username}")
-        return
-
-    os.makedirs(save_folder, exist_ok=True)
-
-    for post in posts:
-        timestamp = post.taken_at.strftime("%Y-%m-%d_%H-%M-%S")
 
-        if post.media_type == 1:
-            media_url = post.thumbnail_url or post.image_versions2['candidates'][0]['url']
-            ext = ".jpg"
-            filename = os.path.join(save_folder, f"{timestamp}{ext}")
-            if should_skip_file(filename):
-                continue
-            download_file(media_url, filename)
-            safe_delay()
-
-        elif post.media_type == 8:
-            for media_index, resource in enumerate(post.resources, start=1):
-                timestamp = (getattr(resource, "taken_at", post.taken_at)).strftime("%Y-%m-%d_%H-%M-%S")
-                ext = ".mp4" if resource.video_url else ".jpg"
-                media_url = resource.video_url if ext == ".mp4" else resource.thumbnail_url
-                filename = os.path.join(save_folder, f"{timestamp}_{media_index}{ext}")
-                if should_skip_file(filename):
-                    continue
-                download_file(media_url, filename)
-                safe_delay()
+    if not count:
+        print(f"No New Posts Found for {username}")
 
 def download_stories(username):
-    save_folder = os.path.join(os.path.dirname(__file__), "data", username, "stories")
+    save_folder = os.path.join(data_dir, username, "stories")
     os.makedirs(save_folder, exist_ok=True)
 
     try:
-        user_id = cl.user_id_from_username(username)
-        safe_delay()
-        stories = cl.user_stories(user_id)
+        user_id = resolve_user_id(username)
+        stories = scheduler.api(cl.user_stories, user_id)
     except Exception as e:
         print(f"Error Fetching Stories for {username}: {e}")
         termination()
@@ -199,46 +451,63 @@ def download_stories(username):
         return
 
     print(f"Found {len(stories)} Stories for {username}")
+    # Expired stories won't come back, whether they were downloaded or not
+    manifest.drop_pending(username, "stories", manifest.pending(username, "stories") - {str(story.pk) for story in stories})
 
     for index, story in enumerate(stories, start=1):
         timestamp = story.taken_at.strftime("%Y-%m-%d_%H-%M-%S")
         ext = ".mp4" if story.media_type == 2 else ".jpg"
         media_url = story.video_url if ext == ".mp4" else story.thumbnail_url
-        filename = os.path.join(save_folder, f"{timestamp}{ext}")
-        if not media_url or should_skip_file(filename):
+        filename = manifest.resolve_path(save_folder, timestamp, ext, story.pk)
+        record = media_record(story, username, "stories")
+        if not media_url or should_skip_file(filename, record):
             continue
-        download_file(media_url, filename, use_headers=True)
-        safe_delay()
+        downloader.submit(media_url, filename, use_headers=True, record=record)
 
 def download_reels(username):
-    save_folder = os.path.join(os.path.dirname(__file__), "data", username, "reels")
+    save_folder = os.path.join(data_dir, username, "reels")
     os.makedirs(save_folder, exist_ok=True)
 
     try:
-        user_id = cl.user_id_from_username(username)
-        safe_delay()
-        reels = cl.user_clips(user_id, amount=0)
+        user_id = resolve_user_id(username)
+        reels = iter_medias(cl.user_clips_paginated_v1, user_id, username, "reels")
+        count = 0
+
+        for idx, reel in enumerate(reels, start=1):
+            count += 1
+            media_url = reel.video_url
+            if not media_url:
+                print(f"Skipping Reel {idx}, No Video URL Found")
+                continue
+
+            timestamp = reel.taken_at.strftime("%Y-%m-%d_%H-%M-%S")
+            ext = ".mp4"
+            filename = manifest.resolve_path(save_folder, timestamp, ext, reel.pk)
+            record = media_record(reel, username, "reels")
+
+            if should_skip_file(filename, record):
+                continue
+
+            downloader.submit(media_url, filename, record=record)
     except Exception as e:
         print(f"Error Fetching Reels for {username}: {e}")
         termination()
 
-    print(f"Total Reels to Download for {username}: {len(reels)}")
-
-    for idx, reel in enumerate(reels, start=1):
-        media_url = reel.video_url
-        if not media_url:
-            print(f"Skipping Reel {idx}, No Video URL Found")
-            continue
-
-        timestamp = reel.taken_at.strftime("%Y-%m-%d_%H-%M-%S")
-        ext = ".mp4"
-        filename = os.path.join(save_folder, f"{timestamp}{ext}")
+    print(f"Total New Reels for {username}: {count}")
 
-        if should_skip_file(filename):
-            continue
+DOWNLOADS = {
+    "posts": download_posts,
+    "highlights": download_highlights,
+    "stories": download_stories,
+    "reels": download_reels,
+}
 
-        download_file(media_url, filename)
-        safe_delay()
+def download_target(target, types):
+    """Run the download_* function of every media type in types for one target."""
+    for media_type in types:
+        with metrics.timer("listing_seconds", media_type=media_type):
+            DOWNLOADS[media_type](target)
+    print(f"Finished Listing {target} {downloader.progress()}")
 
 def main():
     print("0: Download All (Posts + Highlights + Stories + Reels)")
@@ -247,6 +516,7 @@ def main():
     print("3: Download Only Stories")
     print("4: Download Only Reels")
     choice = input("Choose: ").strip()
+    types = MEDIA_TYPES if choice == "0" else [MEDIA_TYPES[int(choice) - 1]] if choice in ("1", "2", "3", "4") else []
 
     print("1: Update Existing from targets.json")
     print("2: Download Single User")
@@ -259,15 +529,8 @@ def main():
         with open(json_file, "r", encoding="utf-8") as f:
             user_list = json.load(f)
         for user in user_list:
-            if choice in ("0", "1"):
-                download_posts(user)
-            if choice in ("0", "2"):
-                download_highlights(user)
-            if choice in ("0", "3"):
-                download_stories(user)
-            if choice in ("0", "4"):
-                download_reels(user)
-            safe_delay(50, 70)
+            download_target(user, types)
+            scheduler.next_target()
 
     elif sub_choice == "2":
         user_list = []
@@ -290,19 +553,30 @@ def main():
         else:
             target = raw_input_val
 
-        if choice in ("0", "1"):
-            download_posts(target)
-        if choice in ("0", "2"):
-            download_highlights(target)
-        if choice in ("0", "3"):
-            download_stories(target)
-        if choice in ("0", "4"):
-            download_reels(target)
+        download_target(target, types)
     else:
         print("Invalid Sub-Choice")
 
+def parse_args():
+    parser = target_parser("Download posts, highlights, stories and reels of Instagram targets.")
+    parser.add_argument("--types", type=media_types, default=list(MEDIA_TYPES),
+                        help="Comma separated media types (default: posts,highlights,stories,reels)")
+    return parser.parse_args()
+
+def run(targets, types):
+    for index, target in enumerate(targets):
+        if index:
+            scheduler.next_target()
+        download_target(target, types)
+
 if __name__ == "__main__":
+    args = parse_args()
     login()
-    main()
+    # Without targets on the command line, ask like before
+    if args.all or args.targets:
+        run(load_targets(json_file) if args.all else args.targets, args.types)
+    else:
+        main()
+    finish_downloads()
     if webhook:
         notify("Program Finished")
\ No newline at end of file
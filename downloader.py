@@ -0,0 +1,238 @@
+import os
+import time
+import queue
+import random
+import hashlib
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# Statuses worth another attempt, any other 4xx (e.g. an expired signed URL) is final
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+class IncompleteDownload(Exception):
+    pass
+
+class Downloader:
+    """Transfer workers draining a bounded queue that metadata discovery fills.
+
+    The download_* functions in download.py are the producers: they put every
+    media URL on the queue as soon as it is known and move on to the next
+    listing call, while the workers stream files to disk over one pooled
+    keep-alive session. A full queue blocks the producer (backpressure).
+
+    Bytes go to "<filename>.part" and are renamed into place only once the
+    size matches what the server announced, so a final file is always
+    complete. A leftover .part is resumed with an HTTP Range request. Failed
+    items are retried with backoff, then parked on a retry queue that close()
+    drains once more instead of aborting the run. With blobs, every finished
+    file is moved into the blob store and replaced by a link to it. With an
+    inbox, every finished file of a target is announced to stream.py.
+
+    With metrics, every transfer's time, the bytes, outcomes, retries and the
+    queue depth are recorded.
+    """
+
+    def __init__(self, workers=4, max_pending=32, chunk_size=1 << 20, buffer_size=1 << 20, manifest=None,
+                 scheduler=None, retries=3, backoff=2.0, retry_rounds=1, retry_delay=30, metrics=None, blobs=None, inbox=None):
+        self.workers = workers
+        self.manifest = manifest
+        self.blobs = blobs
+        self.inbox = inbox
+        self.scheduler = scheduler
+        self.metrics = metrics
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_rounds = retry_rounds
+        self.retry_delay = retry_delay
+
+        # Keep-alive connections shared by every worker, one per concurrent transfer
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.done = 0
+        self.bytes = 0
+        self.failed = []
+
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self.worker, name=f"download-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, url, filename, use_headers=False, record=None):
+        """Queue a transfer, record holds the manifest fields (pk, target, media_type, taken_at)."""
+        if not url:
+            print(f"Skipping Download, URL is None for {filename}")
+            return
+        job = (url, filename, use_headers, record)
+        if self.manifest and record:
+            # Stays pending until recorded, a failed or interrupted transfer is fetched again next run
+            self.manifest.add_pending(path=filename, **record)
+        with self.lock:
+            self.queued += 1
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            print(f"Queue Full ({self.queue.maxsize} Pending), Waiting for Transfers")
+            if self.metrics:
+                with self.metrics.timer("download_queue_blocked_seconds"):
+                    self.queue.put(job)
+            else:
+                self.queue.put(job)
+        if self.metrics:
+            self.metrics.gauge("download_queue_depth", self.queue.qsize())
+
+    def worker(self):
+        while True:
+            job = self.queue.get()
+            if self.metrics:
+                self.metrics.gauge("download_queue_depth", self.queue.qsize())
+            if job is None:
+                self.queue.task_done()
+                return
+            try:
+                self.download(*job)
+            except Exception as e:
+                # A dead worker would leave put() and join() waiting forever
+                print(f"Error Finishing {job[1]}: {type(e).__name__}: {e}")
+                with self.lock:
+                    self.done += 1
+                    self.failed.append(job)
+                if self.metrics:
+                    self.metrics.inc("downloads_total", status="failed")
+            finally:
+                self.queue.task_done()
+
+    def download(self, url, filename, use_headers=False, record=None):
+        for attempt in range(self.retries + 1):
+            start = time.monotonic()
+            try:
+                size, checksum = self.transfer(url, filename, use_headers)
+                if self.metrics:
+                    self.metrics.observe("transfer_seconds", time.monotonic() - start)
+                break
+            except Exception as e:
+                retryable = not isinstance(e, requests.HTTPError) or e.response.status_code in RETRY_STATUS
+                if not retryable or attempt == self.retries:
+                    print(f"Error Downloading {filename}: {e}")
+                    with self.lock:
+                        self.done += 1
+                        self.failed.append((url, filename, use_headers, record))
+                    if self.metrics:
+                        self.metrics.inc("downloads_total", status="failed")
+                    return
+                delay = self.backoff * 2 ** attempt + random.uniform(0, self.backoff)
+                print(f"Retrying {filename} in {delay:.1f} Seconds ({attempt + 1}/{self.retries}): {e}")
+                if self.metrics:
+                    self.metrics.inc("download_retries_total")
+                time.sleep(delay)
+
+        if self.blobs:
+            self.blobs.adopt(filename, checksum)
+        if self.manifest and record:
+            self.manifest.record(path=filename, url=url, size=size, checksum=checksum, **record)
+        if self.inbox and record:
+            self.inbox.put(filename, record["target"], record["media_type"])
+        with self.lock:
+            self.done += 1
+        if self.metrics:
+            self.metrics.inc("downloads_total", status="done")
+        print(f"Downloaded: {filename} {self.progress()}")
+
+    def transfer(self, url, filename, use_headers=False):
+        part = filename + ".part"
+        headers = {
+            "User-Agent": "Mozilla/5.0"
+        } if use_headers else {}
+
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+
+        with self.session.get(url, stream=True, headers=headers, timeout=60) as response:
+            if response.status_code == 416:
+                # The leftover part no longer fits the object, start over
+                os.remove(part)
+                return self.transfer(url, filename, use_headers)
+            response.raise_for_status()
+
+            digest = hashlib.sha256()
+            if response.status_code == 206:
+                with open(part, "rb") as f:
+                    for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                        digest.update(chunk)
+                total = response.headers.get("Content-Range", "").rpartition("/")[2]
+                mode = "ab"
+                print(f"Resuming {filename} at {offset} Bytes")
+            else:
+                offset = 0
+                total = response.headers.get("Content-Length", "")
+                mode = "wb"
+            expected = int(total) if total.isdigit() else None
+
+            size = offset
+            with open(part, mode, buffering=self.buffer_size) as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+                    if self.scheduler:
+                        self.scheduler.transfer(len(chunk))
+                    with self.lock:
+                        self.bytes += len(chunk)
+                    if self.metrics:
+                        self.metrics.inc("transfer_bytes_total", len(chunk))
+
+        if expected is not None and size != expected:
+            raise IncompleteDownload(f"Got {size} of {expected} Bytes")
+        os.replace(part, filename)
+        return size, digest.hexdigest()
+
+    def progress(self):
+        return (f"[{self.done}/{self.queued} Done, {self.queue.qsize()}/{self.queue.maxsize} Queued, "
+                f"{self.bytes / 1048576:.1f} MB]")
+
+    def wait(self):
+        """Block until the queue is drained, return the failed transfers."""
+        self.queue.join()
+        with self.lock:
+            failed, self.failed = self.failed, []
+        return failed
+
+    def retry_failed(self):
+        """Queue the failed transfers again, for runs that go on too long to wait for close()."""
+        with self.lock:
+            failed, self.failed = self.failed, []
+        for job in failed:
+            self.submit(*job)
+        return len(failed)
+
+    def close(self):
+        failed = self.wait()
+        for _ in range(self.retry_rounds):
+            if not failed:
+                break
+            print(f"Retrying {len(failed)} Failed Downloads in {self.retry_delay} Seconds")
+            time.sleep(self.retry_delay)
+            for job in failed:
+                self.submit(*job)
+            failed = self.wait()
+
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.session.close()
+        if self.manifest:
+            for _, filename, _, _ in failed:
+                self.manifest.release(filename)
+        print(f"Transfers Finished {self.progress()}")
+        return failed
@@ -0,0 +1,100 @@
+import os
+import json
+import numpy as np
+
+class EmbeddingStore:
+    """Face analysis results of one user, computed once per image and kept on disk.
+
+    embeddings.npy holds one float32 row per face and is opened memory mapped,
+    embeddings.json maps each image (by real path) to its size, mtime and
+    faces: bbox, det_score and the row of its normed_embedding. An image is
+    only analyzed again when its size or mtime changed, or when it was
+    analyzed in another mode (tag). Faces copied from a near-duplicate are
+    tagged with copied as well and only found while the store is opened
+    with the same copied.
+    """
+
+    def __init__(self, user_dir, dim=512, tag="full", copied=None):
+        self.dim = dim
+        self.tag = tag
+        self.copied = copied
+        self.npy_path = os.path.join(user_dir, "embeddings.npy")
+        self.index_path = os.path.join(user_dir, "embeddings.json")
+        self.files = {}
+        self.matrix = np.zeros((0, dim), dtype=np.float32)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.files = json.load(f)
+            if os.path.exists(self.npy_path):
+                self.matrix = np.load(self.npy_path, mmap_mode="r")
+            else:
+                # Written before the matrix was always saved, only the images without faces hold up
+                self.files = {key: entry for key, entry in self.files.items() if not entry["faces"]}
+        self.new_rows = []
+
+    def __len__(self):
+        return len(self.matrix) + len(self.new_rows)
+
+    def vector(self, row):
+        return self.matrix[row] if row < len(self.matrix) else self.new_rows[row - len(self.matrix)]
+
+    def lookup(self, img_path):
+        """Return the stored faces of an image, None when it was never analyzed or changed since."""
+        key = os.path.realpath(img_path)
+        entry = self.files.get(key)
+        if entry is None:
+            return None
+        stat = os.stat(key)
+        tags = (self.tag, f"{self.tag}|{self.copied}") if self.copied else (self.tag,)
+        if entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime or entry.get("tag", "full") not in tags:
+            return None
+        return entry["faces"]
+
+    def faces(self, img_path, analyze, copied=False):
+        """Return [{"bbox", "det_score", "row"}] for an image, running analyze(img_path) on a miss.
+
+        analyze returns a list of (bbox, det_score, normed_embedding[, frame_index]),
+        or None for unreadable files. copied marks faces that analyze took from
+        a near-duplicate instead of the model.
+        """
+        faces = self.lookup(img_path)
+        if faces is not None:
+            return faces
+        key = os.path.realpath(img_path)
+        stat = os.stat(key)
+        faces = []
+        for bbox, det_score, embedding, *frame in analyze(img_path) or []:
+            face = {"bbox": [float(v) for v in bbox], "det_score": float(det_score), "row": len(self)}
+            if frame:
+                face["frame"] = int(frame[0])
+            faces.append(face)
+            self.new_rows.append(np.asarray(embedding, dtype=np.float32))
+        tag = f"{self.tag}|{self.copied}" if copied else self.tag
+        self.files[key] = {"size": stat.st_size, "mtime": stat.st_mtime, "tag": tag, "faces": faces}
+        return faces
+
+    def embeddings(self, faces):
+        if not faces:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self.vector(face["row"]) for face in faces])
+
+    def save(self):
+        # Written even without rows, the index of images without faces needs it to load
+        if self.new_rows or not os.path.exists(self.npy_path):
+            total = len(self)
+            tmp_path = self.npy_path + ".tmp.npy"
+            out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(total, self.dim))
+            out[:len(self.matrix)] = self.matrix
+            if self.new_rows:
+                out[len(self.matrix):] = np.stack(self.new_rows)
+            out.flush()
+            del out
+            self.matrix = None
+            os.replace(tmp_path, self.npy_path)
+            self.matrix = np.load(self.npy_path, mmap_mode="r")
+            self.new_rows = []
+
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.files, f)
+        os.replace(tmp_path, self.index_path)
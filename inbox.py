@@ -0,0 +1,82 @@
+import os
+import time
+import sqlite3
+import threading
+
+class Inbox:
+    """Durable queue of downloaded files waiting for stream.py, shared by processes through sqlite.
+
+    The downloader puts every finished file on it. A consumer leases a batch
+    for a while and acks it once the results are saved; a batch that isn't
+    acked in time, because the consumer crashed or failed, is handed out
+    again. Every file is therefore processed at least once, and a file that
+    failed max_attempts times stays in the table with its last error.
+    """
+
+    def __init__(self, path, max_attempts=5):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS inbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                path TEXT NOT NULL,
+                target TEXT NOT NULL,
+                media_type TEXT,
+                added REAL NOT NULL,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                done REAL,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS inbox_open ON inbox (done, lease_until);
+        """)
+
+    def put(self, path, target, media_type=None):
+        with self.lock:
+            self.conn.execute("INSERT INTO inbox (path, target, media_type, added) VALUES (?, ?, ?, ?)",
+                              (os.path.abspath(path), target, media_type, time.time()))
+
+    def lease(self, limit, seconds):
+        """Claim up to limit open files, oldest first, as [(id, path, target, media_type, added)]."""
+        now = time.time()
+        with self.lock:
+            # IMMEDIATE takes the write lock first, two consumers never claim the same rows
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.conn.execute(
+                    "SELECT id, path, target, media_type, added FROM inbox WHERE done IS NULL AND attempts < ? "
+                    "AND (lease_until IS NULL OR lease_until < ?) ORDER BY id LIMIT ?",
+                    (self.max_attempts, now, limit)).fetchall()
+                self.conn.executemany("UPDATE inbox SET lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                                      [(now + seconds, row[0]) for row in rows])
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return rows
+
+    def ack(self, ids):
+        with self.lock:
+            self.conn.executemany("UPDATE inbox SET done = ?, error = NULL WHERE id = ?", [(time.time(), i) for i in ids])
+
+    def fail(self, ids, error):
+        """Give leased files back for another attempt."""
+        with self.lock:
+            self.conn.executemany("UPDATE inbox SET lease_until = NULL, error = ? WHERE id = ?", [(error, i) for i in ids])
+
+    def pending(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM inbox WHERE done IS NULL AND attempts < ?",
+                                     (self.max_attempts,)).fetchone()[0]
+
+    def purge(self, age):
+        """Forget files acked more than age seconds ago."""
+        with self.lock:
+            self.conn.execute("DELETE FROM inbox WHERE done < ?", (time.time() - age,))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
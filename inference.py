@@ -0,0 +1,147 @@
+import os
+import cv2
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+def resolve_device(device):
+    """Fall back to CPU when CUDA is requested on a machine without it."""
+    if device and device.startswith("cuda"):
+        try:
+            import torch
+            if torch.cuda.is_available():
+                return device
+        except ImportError:
+            pass
+        print("CUDA Not Available, Falling Back to CPU")
+        return "cpu"
+    return device or "cpu"
+
+def extract_boxes(result):
+    """Plain [class_name, conf, x1, y1, x2, y2] rows of one YOLO result."""
+    return [
+        [result.names[int(cls)], round(float(conf), 4), *(round(float(v), 1) for v in xyxy)]
+        for cls, conf, xyxy in zip(result.boxes.cls, result.boxes.conf, result.boxes.xyxy)
+    ]
+
+def export_onnx(model_path, imgsz):
+    """Return an ONNX version of the weights, exporting it next to the .pt on first use."""
+    if model_path.endswith(".onnx"):
+        return model_path
+    onnx_path = os.path.splitext(model_path)[0] + ".onnx"
+    if not os.path.exists(onnx_path):
+        from ultralytics import YOLO
+        print(f"Exporting {model_path} to ONNX")
+        onnx_path = YOLO(model_path).export(format="onnx", imgsz=imgsz, dynamic=True)
+    return onnx_path
+
+class InferenceEngine:
+    """Batched YOLO inference with images decoded ahead of time on a thread pool.
+
+    backend "torch" runs the weights through PyTorch on device (cuda or cpu),
+    backend "onnx" runs an exported model through ONNX Runtime. With metrics,
+    the time spent waiting on decoding and on the model is recorded per batch,
+    telling a decode-bound run from a model-bound one.
+    """
+
+    def __init__(self, model_path, device="cuda", backend="torch", batch_size=16, imgsz=640, conf=0.25, iou=0.7,
+                 decode_workers=4, prefetch=2, metrics=None):
+        self.device = resolve_device(device)
+        self.metrics = metrics
+        self.conf = conf
+        self.iou = iou
+        self.batch_size = batch_size
+        self.imgsz = imgsz
+        self.decode_workers = decode_workers
+        self.prefetch = prefetch
+
+        from ultralytics import YOLO
+        if backend == "onnx":
+            self.model = YOLO(export_onnx(model_path, imgsz), task="detect")
+        else:
+            self.model = YOLO(model_path)
+            self.model.to(self.device)
+        print(f"Loaded {model_path} ({backend}, {self.device}, Batch {batch_size}, Size {imgsz})")
+
+    def timed_predict(self, images, kind):
+        start = time.monotonic()
+        outputs = self.predict(images)
+        if self.metrics:
+            self.metrics.observe("inference_batch_seconds", time.monotonic() - start, kind=kind)
+            self.metrics.inc("inference_images_total", len(images), kind=kind)
+        return outputs
+
+    def decoded(self, futures, kind):
+        """Results of one batch's decode futures, timing how long the model side waited for them."""
+        start = time.monotonic()
+        try:
+            return [future.result() for future in futures]
+        finally:
+            if self.metrics:
+                self.metrics.observe("decode_wait_seconds", time.monotonic() - start, kind=kind)
+
+    def predict(self, images):
+        return self.model.predict(images, imgsz=self.imgsz, conf=self.conf, iou=self.iou,
+                                  device=self.device, verbose=False)
+
+    def run(self, paths):
+        """Yield (path, result) for every path in order, result is None when the image can't be read.
+
+        Up to prefetch batches are decoded while the current one is on the model.
+        """
+        batches = [paths[i:i + self.batch_size] for i in range(0, len(paths), self.batch_size)]
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=self.decode_workers, thread_name_prefix="decode") as pool:
+            for index in range(len(batches)):
+                while len(pending) <= self.prefetch and index + len(pending) < len(batches):
+                    batch = batches[index + len(pending)]
+                    pending.append((batch, [pool.submit(cv2.imread, path) for path in batch]))
+
+                batch, futures = pending.popleft()
+                images = self.decoded(futures, "image")
+                readable = [(path, image) for path, image in zip(batch, images) if image is not None]
+                if self.metrics and len(readable) < len(batch):
+                    self.metrics.inc("inference_unreadable_total", len(batch) - len(readable))
+
+                results = {}
+                if readable:
+                    try:
+                        outputs = self.timed_predict([image for _, image in readable], "image")
+                        results = {path: output for (path, _), output in zip(readable, outputs)}
+                    except Exception as e:
+                        print(f"Batch of {len(readable)} Images Failed: {e}")
+
+                for path in batch:
+                    yield path, results.get(path)
+
+    def run_videos(self, paths, sample):
+        """Yield (path, [(frame_index, result)]) for every video, sample(path) picks the frames.
+
+        Clips are sampled on the decode pool while earlier ones are on the model,
+        their frames go through predict in batches like images do.
+        """
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.decode_workers, thread_name_prefix="decode") as pool:
+            for index in range(len(paths)):
+                while len(pending) <= self.prefetch and index + len(pending) < len(paths):
+                    path = paths[index + len(pending)]
+                    pending.append((path, pool.submit(sample, path)))
+
+                path, future = pending.popleft()
+                try:
+                    frames = self.decoded([future], "video")[0]
+                except Exception as e:
+                    print(f"Can't Decode {os.path.basename(path)}: {e}")
+                    frames = []
+
+                results = []
+                try:
+                    for i in range(0, len(frames), self.batch_size):
+                        batch = frames[i:i + self.batch_size]
+                        outputs = self.timed_predict([frame for _, frame in batch], "frame")
+                        results.extend((frame_index, output) for (frame_index, _), output in zip(batch, outputs))
+                except Exception as e:
+                    print(f"Video {os.path.basename(path)} Failed: {e}")
+                    results = None
+                yield path, results if frames else None
@@ -0,0 +1,122 @@
+import os
+import json
+import glob
+import shutil
+import contextlib
+
+MODES = ("copy", "hardlink", "symlink", "reflink", "index")
+
+# ioctl request number of Linux FICLONE, shares the extents of one file with another
+FICLONE = 0x40049409
+
+def reflink(src, dst):
+    import fcntl
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+@contextlib.contextmanager
+def user_lock(user_dir):
+    """Hold output/<user>/.lock, so detection.py, match.py and stream.py write a user's output one at a time.
+
+    Each of them loads index.json, detections.json and the embedding store,
+    adds its own entries and writes the files back whole, a writer running
+    alongside would lose the other's entries. Without fcntl (Windows) the
+    lock is not taken.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    os.makedirs(user_dir, exist_ok=True)
+    with open(os.path.join(user_dir, ".lock"), "w") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print(f"Waiting for Another Process Writing {user_dir}")
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+class OutputLayout:
+    """Places classified images under output/<user>/<category>.
+
+    copy keeps the original independent copies, hardlink/symlink/reflink
+    create links to the source instead, and index writes nothing but a
+    category -> {name: source path} map to output/<user>/index.json. When a
+    link can't be created (other filesystem, no reflink support) the file is
+    copied instead.
+    """
+
+    def __init__(self, user_dir, mode="copy"):
+        if mode not in MODES:
+            raise ValueError(f"Unknown Output Mode {mode}, Expected One of {', '.join(MODES)}")
+        self.user_dir = user_dir
+        self.mode = mode
+        self.index_path = os.path.join(user_dir, "index.json")
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+        self.warned = False
+
+    def directory(self, category):
+        return os.path.join(self.user_dir, category)
+
+    def create(self, *categories):
+        for category in categories:
+            if self.mode == "index":
+                self.index.setdefault(category, {})
+            else:
+                os.makedirs(self.directory(category), exist_ok=True)
+
+    def exists(self, category):
+        return category in self.index or os.path.isdir(self.directory(category))
+
+    def place(self, src, category, name):
+        src = os.path.realpath(src)
+        if self.mode == "index":
+            self.index.setdefault(category, {})[name] = src
+            return
+
+        os.makedirs(self.directory(category), exist_ok=True)
+        dst = os.path.join(self.directory(category), name)
+        if os.path.lexists(dst):
+            if os.path.exists(dst) and os.path.samefile(src, dst):
+                return
+            os.remove(dst)
+
+        try:
+            if self.mode == "hardlink":
+                os.link(src, dst)
+            elif self.mode == "symlink":
+                os.symlink(src, dst)
+            elif self.mode == "reflink":
+                reflink(src, dst)
+            else:
+                shutil.copy2(src, dst)
+        except (OSError, ImportError) as e:
+            if not self.warned:
+                print(f"Can't Create {self.mode.title()} ({e}), Copying Instead")
+                self.warned = True
+            if os.path.lexists(dst):
+                os.remove(dst)
+            shutil.copy2(src, dst)
+
+    def entries(self, category):
+        """Return (name, path) for every image of a category, files on disk and indexed ones."""
+        entries = dict(self.index.get(category, {}))
+        for path in glob.glob(os.path.join(self.directory(category), "*")):
+            entries[os.path.basename(path)] = path
+        return list(entries.items())
+
+    def save(self):
+        if self.mode != "index":
+            return
+        os.makedirs(self.user_dir, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.index_path)
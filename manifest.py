@@ -0,0 +1,216 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+class Manifest:
+    """On-disk record of every downloaded media item, keyed by Instagram media pk.
+
+    The same pk may legitimately live under several paths (a story that is also
+    saved in a highlight), so rows are unique per (pk, path). Watermarks hold
+    the newest media seen by the last completed listing of a target, cursors
+    the position of a listing that has not reached its end yet. pending
+    holds the files queued for download and not recorded yet, whether they
+    failed or the run ended first. schedule holds when daemon.py polls each
+    target and media type next.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS media (
+                pk TEXT NOT NULL,
+                path TEXT NOT NULL,
+                target TEXT,
+                media_type TEXT,
+                url TEXT,
+                size INTEGER,
+                checksum TEXT,
+                taken_at TEXT,
+                downloaded_at TEXT,
+                PRIMARY KEY (pk, path)
+            );
+            CREATE INDEX IF NOT EXISTS media_path ON media (path);
+            CREATE TABLE IF NOT EXISTS watermarks (
+                target TEXT NOT NULL,
+                media_type TEXT NOT NULL,
+                last_pk TEXT,
+                last_taken_at TEXT,
+                updated_at TEXT,
+                PRIMARY KEY (target, media_type)
+            );
+            CREATE TABLE IF NOT EXISTS cursors (
+                target TEXT NOT NULL,
+                media_type TEXT NOT NULL,
+                cursor TEXT NOT NULL,
+                updated_at TEXT,
+                PRIMARY KEY (target, media_type)
+            );
+            CREATE TABLE IF NOT EXISTS pending (
+                pk TEXT NOT NULL,
+                path TEXT NOT NULL,
+                target TEXT,
+                media_type TEXT,
+                taken_at TEXT,
+                queued_at TEXT,
+                PRIMARY KEY (pk, path)
+            );
+            CREATE INDEX IF NOT EXISTS pending_target ON pending (target, media_type);
+            CREATE TABLE IF NOT EXISTS schedule (
+                target TEXT NOT NULL,
+                media_type TEXT NOT NULL,
+                next_poll REAL NOT NULL,
+                last_poll REAL,
+                interval REAL,
+                idle INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (target, media_type)
+            );
+        """)
+        self.conn.commit()
+        # Paths handed out in this run but not downloaded yet
+        self.reserved = {}
+
+    def has(self, pk, path=None):
+        with self.lock:
+            if path is None:
+                row = self.conn.execute("SELECT 1 FROM media WHERE pk = ? LIMIT 1", (str(pk),)).fetchone()
+            else:
+                row = self.conn.execute("SELECT 1 FROM media WHERE pk = ? AND path = ?", (str(pk), path)).fetchone()
+        return row is not None
+
+    def find(self, pk):
+        """(path, size, checksum) of every file downloaded for a pk."""
+        with self.lock:
+            return self.conn.execute("SELECT path, size, checksum FROM media WHERE pk = ?", (str(pk),)).fetchall()
+
+    def owner(self, path):
+        with self.lock:
+            if path in self.reserved:
+                return self.reserved[path]
+            row = self.conn.execute("SELECT pk FROM media WHERE path = ? LIMIT 1", (path,)).fetchone()
+        return row[0] if row else None
+
+    def resolve_path(self, folder, stem, ext, pk):
+        """Return the file path for a media pk, disambiguating items taken in the same second."""
+        pk = str(pk)
+        path = os.path.join(folder, f"{stem}{ext}")
+        owner = self.owner(path)
+        if owner is not None and owner != pk:
+            path = os.path.join(folder, f"{stem}_{pk}{ext}")
+        with self.lock:
+            self.reserved[path] = pk
+        return path
+
+    def record(self, pk, path, target=None, media_type=None, url=None, size=None, checksum=None, taken_at=None):
+        with self.lock:
+            self.reserved.pop(path, None)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                # instagrapi hands out pydantic HttpUrl objects, sqlite only takes str
+                (str(pk), path, target, media_type, None if url is None else str(url), size, checksum,
+                 taken_at.isoformat() if isinstance(taken_at, datetime) else taken_at,
+                 datetime.now().isoformat(timespec="seconds")),
+            )
+            self.conn.execute("DELETE FROM pending WHERE pk = ? AND path = ?", (str(pk), path))
+            self.conn.commit()
+
+    def add_pending(self, pk, path, target=None, media_type=None, taken_at=None):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pending VALUES (?, ?, ?, ?, ?, ?)",
+                (str(pk), path, target, media_type,
+                 taken_at.isoformat() if isinstance(taken_at, datetime) else taken_at,
+                 datetime.now().isoformat(timespec="seconds")),
+            )
+            self.conn.commit()
+
+    def pending(self, target, media_type):
+        """pks of a target whose download was queued but never finished."""
+        with self.lock:
+            rows = self.conn.execute("SELECT pk FROM pending WHERE target = ? AND media_type = ?",
+                                     (target, media_type)).fetchall()
+        return {row[0] for row in rows}
+
+    def drop_pending(self, target, media_type, pks):
+        """Forget pending pks that are gone from the account."""
+        with self.lock:
+            self.conn.executemany("DELETE FROM pending WHERE target = ? AND media_type = ? AND pk = ?",
+                                  [(target, media_type, pk) for pk in pks])
+            self.conn.commit()
+
+    def release(self, path):
+        with self.lock:
+            self.reserved.pop(path, None)
+
+    def get_watermark(self, target, media_type):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT last_pk, last_taken_at FROM watermarks WHERE target = ? AND media_type = ?",
+                (target, media_type),
+            ).fetchone()
+        if not row:
+            return None
+        return row[0], datetime.fromisoformat(row[1])
+
+    def set_watermark(self, target, media_type, pk, taken_at):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?, ?)",
+                (target, media_type, str(pk), taken_at.isoformat(),
+                 datetime.now().isoformat(timespec="seconds")),
+            )
+            self.conn.commit()
+
+    def get_cursor(self, target, media_type):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT cursor FROM cursors WHERE target = ? AND media_type = ?",
+                (target, media_type),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_cursor(self, target, media_type, cursor):
+        with self.lock:
+            if cursor:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO cursors VALUES (?, ?, ?, ?)",
+                    (target, media_type, cursor, datetime.now().isoformat(timespec="seconds")),
+                )
+            else:
+                self.conn.execute("DELETE FROM cursors WHERE target = ? AND media_type = ?", (target, media_type))
+            self.conn.commit()
+
+    def recent_taken_at(self, target, media_type, limit):
+        """taken_at of the newest distinct media of a target, newest first."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT DISTINCT taken_at FROM media WHERE target = ? AND media_type = ? AND taken_at IS NOT NULL "
+                "ORDER BY taken_at DESC LIMIT ?",
+                (target, media_type, limit),
+            ).fetchall()
+        return [datetime.fromisoformat(row[0]) for row in rows]
+
+    def get_schedule(self, target, media_type):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT next_poll, last_poll, interval, idle FROM schedule WHERE target = ? AND media_type = ?",
+                (target, media_type),
+            ).fetchone()
+        if not row:
+            return None
+        return {"next_poll": row[0], "last_poll": row[1], "interval": row[2], "idle": row[3]}
+
+    def set_schedule(self, target, media_type, next_poll, last_poll, interval, idle):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO schedule VALUES (?, ?, ?, ?, ?, ?)",
+                (target, media_type, next_poll, last_poll, interval, idle),
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -1,11 +1,18 @@
 import os
 import cv2
-import glob
 import json
-import shutil
+import time
+import threading
 import numpy as np
-from insightface.app import FaceAnalysis
-from ultralytics import YOLO
+from layout import OutputLayout, user_lock
+from embeddings import EmbeddingStore
+from video import is_video, sampler, sampling_key
+from metrics import Metrics
+from cli import target_parser, selected_targets
+from worker import connect, WorkerError
+from blobs import unique_paths, preference
+from neardup import HashCache, group, ratio, copy_key
+from shards import create_pool, run_chunks, for_each
 
 # Load Setting
 with open("setting.json", "r", encoding="utf-8") as cf:
@@ -15,130 +22,429 @@ with open("config.json", "r", encoding="utf-8") as f:
     config = json.load(f)
 
 model_path = config.get("model_path")
+output_mode = config.get("output_mode", "copy")
 confidence_threshold = setting.get("confidence_threshold")
 bounding_box_size = setting.get("bounding_box_size")
 similarity_upper = setting.get("similarity_upper")
 similarity_lower = setting.get("similarity_lower")
 similarity_step = setting.get("similarity_step")
-
-# Initialize Models
-face_app = FaceAnalysis(name="antelopev2", root="./", providers=['CUDAExecutionProvider'])
-face_app.prepare(ctx_id=0)
-
-model = YOLO(model_path)
-model.to("cuda")
-
-# Load Targets List
-with open("targets.json", "r", encoding="utf-8") as f:
-    targets = json.load(f)
-
-print("Select a Target to Self-Train:")
-print("0. All")
-for idx, user in enumerate(targets, start=1):
-    print(f"{idx}. {user}")
-
-choice = input("Enter the Number Correspondingly: ").strip()
-if choice == "0":
-    selected_users = targets
-else:
-    try:
-        selected_users = [targets[int(choice) - 1]]
-    except (IndexError, ValueError):
-        print("Invalid Selection")
-        exit(1)
-
-def average_embeddings(folder):
-    embeddings = []
-    for img_path in glob.glob(os.path.join(folder, "*")):
-        img = cv2.imread(img_path)
-        if img is None:
+face_crop = setting.get("face_crop", False)
+crop_padding = setting.get("crop_padding", 0.15)
+crop_det_size = setting.get("crop_det_size", 320)
+crop_max_area = setting.get("crop_max_area", 0.5)
+match_mode = setting.get("match_mode", "descent")
+cluster_k = setting.get("cluster_k", 10)
+hash_kind = config.get("near_duplicate_hash", "phash")
+hash_distance = config.get("near_duplicate_distance", 4)
+
+# Face models are loaded by get_face_app() once an image actually needs them
+face_app = None
+# Connection to worker.py, which embeds the faces instead when it's up
+worker = None
+worker_batch = config.get("worker_batch", 64)
+# Process pool of main() --processes, each process loads the face models once
+pool = None
+shard_threads = config.get("shard_threads", 1)
+shard_chunk = config.get("shard_chunk", 32)
+
+# YOLO is only needed for images detection.py didn't index
+model = None
+# The targets main() runs side by side share face_app and model, they are loaded and run by one at a time
+model_lock = threading.RLock()
+# Same frames detection.py sampled, so their person boxes line up
+sample_video = sampler(config)
+# Perceptual hashes shared with detection.py, near-duplicates are embedded once
+hashes = None
+# Replaced by main() with one that writes to metrics_dir
+metrics = Metrics("match")
+
+def person_crops(img, persons):
+    """Padded person regions as (x1, y1, x2, y2), None when they cover too much of the image to pay off."""
+    h, w = img.shape[:2]
+    crops = []
+    for score, x1, y1, x2, y2 in persons:
+        if score < 0.25:
             continue
-        faces = face_app.get(img)
-        for face in faces:
-            embeddings.append(face.normed_embedding)
-    if not embeddings:
+        pad = crop_padding * max(x2 - x1, y2 - y1)
+        crops.append((max(0, int(x1 - pad)), max(0, int(y1 - pad)), min(w, int(x2 + pad)), min(h, int(y2 + pad))))
+    area = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in crops)
+    if not crops or area > crop_max_area * w * h:
         return None
-    return np.mean(embeddings, axis=0)  # Average embedding
-
-def test_output(img):
-    results = model.predict(source=img, imgsz=640, conf=0.25, iou=0.45, verbose=False)
+    return crops
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0
+
+def analyze_crops(img, crops):
+    """Detect faces inside person crops at crop_det_size, then embed all of them in one batch."""
+    found = []
+    face_app = get_face_app()
+    for cx1, cy1, cx2, cy2 in crops:
+        bboxes, kpss = face_app.det_model.detect(img[cy1:cy2, cx1:cx2], input_size=(crop_det_size, crop_det_size), max_num=0)
+        for bbox, kps in zip(bboxes, kpss):
+            # Back to full-image coordinates
+            bbox[:4] += (cx1, cy1, cx1, cy1)
+            kps += (cx1, cy1)
+            found.append((bbox[:4], float(bbox[4]), kps))
+
+    # Overlapping crops see the same face twice, keep the most confident one
+    faces = []
+    for face in sorted(found, key=lambda f: -f[1]):
+        if all(iou(face[0], kept[0]) < 0.5 for kept in faces):
+            faces.append(face)
+    if not faces:
+        return []
+
+    from insightface.utils import face_align
+    recognition = face_app.models["recognition"]
+    aligned = [face_align.norm_crop(img, landmark=kps, image_size=recognition.input_size[0]) for _, _, kps in faces]
+    embeddings = recognition.get_feat(aligned)
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return [(bbox, score, embedding) for (bbox, score, _), embedding in zip(faces, embeddings)]
+
+def analyze_image(img, persons=None):
+    with model_lock:
+        if face_crop and persons is not None:
+            crops = person_crops(img, persons)
+            if crops is not None:
+                return analyze_crops(img, crops)
+        return [(face.bbox, face.det_score, face.normed_embedding) for face in get_face_app().get(img)]
+
+def analyze(img_path, persons=None):
+    """Faces of an image, or of the sampled frames of a video tagged with their frame index."""
+    if is_video(img_path):
+        frame_persons = dict(persons["frames"]) if persons else {}
+        faces = []
+        for frame_index, frame in sample_video(img_path):
+            faces.extend((*face, frame_index) for face in analyze_image(frame, frame_persons.get(frame_index)))
+        return faces
+    img = cv2.imread(img_path)
+    if img is None:
+        return None
+    return analyze_image(img, persons)
+
+def init_shard():
+    """Set up a pool process, the face models are loaded once and serve every chunk it gets."""
+    get_face_app()
+
+def embed_chunk(items):
+    """analyze() of every (path, persons) item, what worker.py and the pool run."""
+    return [analyze(img_path, persons) for img_path, persons in items]
+
+def image_faces(store, name, img_path, detections):
+    return store.faces(img_path, lambda path: analyze(path, detections.get(name)))
+
+def near_duplicates(missing):
+    """(groups, hashes) of the images to embed by path, videos always stand alone."""
+    paths = [img_path for _, img_path in missing]
+    if hashes is None:
+        return {img_path: [] for img_path in paths}, {}
+    found = hashes.hashes([img_path for img_path in paths if not is_video(img_path)])
+    groups = group(paths, found, hash_distance)
+    members = len(paths) - len(groups)
+    if members:
+        print(f"Grouped {members} Near-Duplicate Images, Embedding {len(groups)}")
+        metrics.inc("match_near_duplicates_total", members)
+    return groups, found
+
+def copied_faces(store, source, found, target):
+    """Faces of source as faces of its near-duplicate target, same embeddings and boxes moved to target's scale."""
+    sx, sy = ratio(found, source, target)
+    return [([face["bbox"][0] * sx, face["bbox"][1] * sy, face["bbox"][2] * sx, face["bbox"][3] * sy],
+             face["det_score"], store.vector(face["row"])) for face in store.lookup(source) or []]
+
+def embed_missing(store, missing, detections):
+    """Analyze the (name, path) entries the store doesn't know, through worker.py in batches when it's up.
+
+    Near-duplicates of an analyzed image get its faces without being analyzed.
+    """
+    global worker
+    groups, found = near_duplicates(missing)
+    members = [(img_path, member) for img_path, group_members in groups.items() for member in group_members]
+    missing = [(name, img_path) for name, img_path in missing if img_path in groups]
+    done = 0
+    while worker is not None and done < len(missing):
+        chunk = missing[done:done + worker_batch]
+        try:
+            # The worker may run from another directory
+            results = worker.embed([(os.path.abspath(img_path), detections.get(name)) for name, img_path in chunk])
+        except (OSError, EOFError, WorkerError) as e:
+            print(f"Inference Worker Failed ({e}), Running Locally")
+            worker = None
+            break
+        for (name, img_path), faces in zip(chunk, results):
+            store.faces(img_path, lambda path: faces)
+        done += len(chunk)
+    if pool is not None and done < len(missing):
+        items = [(img_path, detections.get(name)) for name, img_path in missing[done:]]
+        for (name, img_path), faces in zip(missing[done:], run_chunks(pool, embed_chunk, items, shard_chunk, embed_chunk)):
+            store.faces(img_path, lambda path: faces)
+        done = len(missing)
+    for name, img_path in missing[done:]:
+        image_faces(store, name, img_path, detections)
+    for img_path, member in members:
+        faces = copied_faces(store, img_path, found, member)
+        # Tagged apart from analyzed faces, turning grouping off or changing it analyzes the member
+        store.faces(member, lambda path: faces, copied=True)
+
+def collapse(entries):
+    """(name, path) entries without duplicates, a story detected again from its highlight is matched once."""
+    names = {}
+    for name, img_path in sorted(entries, key=lambda entry: preference(entry[0])):
+        names.setdefault(img_path, name)
+    unique = [(names[img_path], img_path) for img_path in unique_paths(list(names))]
+    if len(unique) < len(entries):
+        print(f"Collapsed {len(entries) - len(unique)} Duplicate Images")
+        metrics.inc("match_duplicates_total", len(entries) - len(unique))
+    return unique
+
+def face_matrix(entries, store, detections):
+    """Stack the faces of all entries into one matrix, with the entry index owning each row."""
+    blocks = [store.embeddings(image_faces(store, name, img_path, detections)) for name, img_path in entries]
+    owners = [np.full(len(block), index) for index, block in enumerate(blocks)]
+    if not blocks:
+        return np.zeros((0, store.dim), dtype=np.float32), np.zeros(0, dtype=int)
+    return np.concatenate(blocks), np.concatenate(owners).astype(int)
+
+def load_detections(user_dir):
+    index_path = os.path.join(user_dir, "detections.json")
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def predict_persons(img_path):
+    if is_video(img_path):
+        frames = sample_video(img_path)
+        return {"frames": [[frame_index, predict_frame(frame)] for frame_index, frame in frames]}
+    return predict_frame(img_path)
+
+def predict_frame(source):
+    global model
+    with model_lock:
+        if model is None:
+            from ultralytics import YOLO
+            from inference import resolve_device
+            model = YOLO(model_path)
+            model.to(resolve_device(config.get("device", "cuda")))
+        results = model.predict(source=source, imgsz=640, conf=0.25, iou=0.45, verbose=False)
     r = results[0]
+    return [[float(score), *map(float, box)] for cls, score, box in zip(r.boxes.cls, r.boxes.conf, r.boxes.xyxy) if int(cls) == 0]
 
-    person_boxes = [(cls, score, box) for cls, score, box in zip(r.boxes.cls, r.boxes.conf, r.boxes.xyxy) if int(cls) == 0]
-    person_count = len(person_boxes)
-
-    is_single = person_count == 1
+def test_output(filename, img_path, detections):
+    entry = detections.get(filename)
+    if entry is None:
+        entry = predict_persons(img_path)
+    # A video is single when every sampled frame showing people shows exactly one
+    frames = [boxes for _, boxes in entry["frames"]] if isinstance(entry, dict) else [entry]
+    counts = []
 
     passed_test = False
-    for cls, score, box in person_boxes:
-        if float(score) >= confidence_threshold:
-            x1, y1, x2, y2 = box
-            area = float((x2 - x1) * (y2 - y1))
-            if area >= bounding_box_size:
-                passed_test = True
-                break
+    for person_boxes in frames:
+        # detection.py may keep boxes below the 0.25 this test has always used
+        person_boxes = [box for box in person_boxes if box[0] >= 0.25]
+        counts.append(len(person_boxes))
+
+        for score, x1, y1, x2, y2 in person_boxes:
+            if score >= confidence_threshold:
+                area = (x2 - x1) * (y2 - y1)
+                if area >= bounding_box_size:
+                    passed_test = True
+                    break
+
+    seen = [count for count in counts if count]
+    is_single = bool(seen) and all(count == 1 for count in seen)
 
     return is_single, passed_test
 
-def self_train_user(user):
-    detected_dir = os.path.join("output", user, "detected")
-    single_dir = os.path.join("output", user, "single")
-    multiple_dir = os.path.join("output", user, "multiple")
-    ambiguous_dir = os.path.join("output", user, "ambiguous")
-    unmatched_dir = os.path.join("output", user, "unmatched")
+def knn_graph(faces, k, block=None):
+    """Return (rows, cols, similarities) linking every face to its k most similar other faces.
+
+    Uses a faiss HNSW index when faiss is installed, otherwise exact search in
+    blocks of matrix products. A block holds about 2**26 similarities
+    unless block rows are given, so memory stays flat as n grows.
+    """
+    n = len(faces)
+    k = min(k, n - 1)
+    if k <= 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0, dtype=np.float32)
+    faces = np.ascontiguousarray(faces, dtype=np.float32)
+    try:
+        import faiss
+        index = faiss.IndexHNSWFlat(faces.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+        index.add(faces)
+        sims, cols = index.search(faces, k + 1)
+    except ImportError:
+        block = block or max(1, 2 ** 26 // n)
+        sims = np.empty((n, k + 1), dtype=np.float32)
+        cols = np.empty((n, k + 1), dtype=np.int64)
+        for start in range(0, n, block):
+            block_sims = faces[start:start + block] @ faces.T
+            # The k + 1 largest end up last, no negated copy of the block
+            top = np.argpartition(block_sims, -(k + 1), axis=1)[:, -(k + 1):]
+            sims[start:start + block] = np.take_along_axis(block_sims, top, axis=1)
+            cols[start:start + block] = top
+    rows = np.repeat(np.arange(n), k + 1)
+    cols = cols.ravel()
+    sims = sims.ravel()
+    keep = (cols >= 0) & (cols != rows)
+    return rows[keep], cols[keep], sims[keep]
+
+def components(n, rows, cols):
+    """Connected component label of every node, by union-find over the edges."""
+    parent = np.arange(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in zip(rows, cols):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    return np.array([find(i) for i in range(n)])
+
+def cluster_identity(faces, owner, seed_center=None):
+    """Mask of the faces belonging to the target, found as the dominant cluster of the kNN graph.
+
+    Edges at or above similarity_upper form the clusters. The dominant one is
+    the cluster spanning the most images; when single has seeds, only clusters
+    whose centroid has a similarity of at least similarity_lower to the seed
+    centroid qualify. Faces with an edge into it and a centroid similarity of
+    at least similarity_lower are attached afterwards.
+    """
+    if not len(faces):
+        return np.zeros(0, dtype=bool)
+    rows, cols, sims = knn_graph(faces, cluster_k)
+    strong = sims >= similarity_upper
+    _, labels = np.unique(components(len(faces), rows[strong], cols[strong]), return_inverse=True)
+    clusters = labels.max() + 1
+
+    # Distinct images per cluster, a face seen twice in one image counts once
+    pairs = np.unique(np.stack([labels, owner]), axis=1)
+    image_counts = np.bincount(pairs[0], minlength=clusters)
+    if seed_center is not None:
+        sums = np.zeros((clusters, faces.shape[1]))
+        np.add.at(sums, labels, faces)
+        centroids = sums / np.bincount(labels, minlength=clusters)[:, None]
+        image_counts[centroids @ seed_center < similarity_lower] = 0
+    if not image_counts.any():
+        return np.zeros(len(faces), dtype=bool)
+
+    identity = labels == np.argmax(image_counts)
+    center = faces[identity].mean(axis=0)
+    linked = np.zeros(len(faces), dtype=bool)
+    weak = (sims >= similarity_lower) & identity[cols]
+    linked[rows[weak]] = True
+    return identity | (linked & (faces @ center >= similarity_lower))
+
+def place_match(layout, filename, img_path, detections):
+    """Sort an image of the target into single, ambiguous or multiple, return True for single."""
+    is_single, passed_test = test_output(filename, img_path, detections)
+    category = ("single" if passed_test else "ambiguous") if is_single else "multiple"
+    metrics.inc("match_images_total", category=category)
+    layout.place(img_path, category, filename)
+    return category == "single"
+
+def lap(stage, user, start):
+    """Record the time since start as one stage of self_train_user, return the new start."""
+    now = time.monotonic()
+    metrics.observe("match_stage_seconds", now - start, stage=stage, user=user)
+    return now
+
+def embed_detected(layout):
+    """(store, detections, detected) of a user, every detected image embedded once.
+
+    Later rounds and runs only read the store, stream.py calls this as files
+    arrive so match.py finds them embedded.
+    """
+    copied = None if hashes is None else copy_key(hashes.kind, hash_distance)
+    store = EmbeddingStore(layout.user_dir, tag="crop" if face_crop else "full", copied=copied)
+    detections = load_detections(layout.user_dir)
+    detected = collapse(layout.entries("detected"))
+    missing = [(name, img_path) for name, img_path in detected if store.lookup(img_path) is None]
+    print(f"Embedding {len(missing)} New Images ({len(detected) - len(missing)} Stored)")
+    embed_missing(store, missing, detections)
+    store.save()
+    metrics.inc("match_embedded_total", len(missing))
+    return store, detections, detected
 
-    for d in [single_dir, multiple_dir, ambiguous_dir, unmatched_dir]:
-        os.makedirs(d, exist_ok=True)
+def self_train_user(user):
+    layout = OutputLayout(os.path.join("output", user), output_mode)
+    layout.create("single", "multiple", "ambiguous", "unmatched")
 
-    if not os.path.exists(detected_dir):
+    if not layout.exists("detected"):
         print(f"[{user}] Missing Detected Folder")
         return
 
     print(f"\nSelf-training for User: {user}")
+    start = time.monotonic()
     threshold = similarity_upper
     used_images = set()
 
-    while True:
+    store, detections, detected = embed_detected(layout)
+    start = lap("embed", user, start)
+    detected_paths = dict(detected)
+
+    # One row per candidate face, owner maps it back to its image in detected
+    faces, owner = face_matrix(detected, store, detections)
+    used = np.zeros(len(detected), dtype=bool)
+
+    # Running sum of every face in single, the centroid is its mean
+    single = [(name, detected_paths.get(name, img_path)) for name, img_path in layout.entries("single")]
+    single_names = {name for name, _ in single}
+    single_faces, _ = face_matrix(single, store, detections)
+    center_sum = single_faces.sum(axis=0, dtype=np.float64)
+    center_count = len(single_faces)
+    metrics.gauge("match_faces", len(faces), user=user)
+    start = lap("matrix", user, start)
+
+    if match_mode == "cluster":
+        seed_center = (center_sum / center_count).astype(np.float32) if center_count else None
+        identity = cluster_identity(faces, owner, seed_center)
+        used[owner[identity]] = True
+        print(f"Clustered {len(faces)} Faces, {int(used.sum())} Images Belong to {user}")
+        for index in np.flatnonzero(used):
+            filename, img_path = detected[index]
+            used_images.add(filename)
+            place_match(layout, filename, img_path, detections)
+
+    while match_mode != "cluster":
         print(f"\nCurrent Similarity Threshold: {threshold:.2f}")
-        center_embedding = average_embeddings(single_dir)
-        if center_embedding is None:
+        if not center_count:
             print("No Embeddings Found, Skipping")
+            store.save()
+            lap("descent", user, start)
             return
+        center_embedding = (center_sum / center_count).astype(np.float32)
 
+        # Every unused image with at least one face above the threshold, in detected order
+        similarities = faces @ center_embedding
+        matched = np.zeros(len(detected), dtype=bool)
+        matched[owner[similarities > threshold]] = True
         new_matches = 0
+        promoted = []
 
-        for img_path in glob.glob(os.path.join(detected_dir, "*")):
-            filename = os.path.basename(img_path)
-            if filename in used_images:
-                continue
-
-            img = cv2.imread(img_path)
-            if img is None:
-                continue
-
-            faces = face_app.get(img)
-            matched = False
-            for face in faces:
-                emb = face.normed_embedding
-                similarity = np.dot(center_embedding, emb)
-                if similarity > threshold:
-                    matched = True
-                    break
-
-            if not matched:
-                continue
-
+        for index in np.flatnonzero(matched & ~used):
+            filename, img_path = detected[index]
+            used[index] = True
             used_images.add(filename)
-            is_single, passed_test = test_output(img)
 
-            if is_single:
-                if passed_test:
-                    shutil.copy(img_path, os.path.join(single_dir, filename))
-                    new_matches += 1
-                else:
-                    shutil.copy(img_path, os.path.join(ambiguous_dir, filename))
-            else:
-                shutil.copy(img_path, os.path.join(multiple_dir, filename))
+            if place_match(layout, filename, img_path, detections):
+                new_matches += 1
+                if filename not in single_names:
+                    single_names.add(filename)
+                    promoted.append(index)
+
+        for index in promoted:
+            center_sum += faces[owner == index].sum(axis=0, dtype=np.float64)
+            center_count += int(np.count_nonzero(owner == index))
 
         print(f"Matched {new_matches} Images")
 
@@ -147,14 +453,77 @@ def self_train_user(user):
 
         if threshold > similarity_lower:
             threshold = max(threshold - similarity_step, similarity_lower)
+    start = lap(match_mode, user, start)
 
     # Final Unmatched Handling
-    for img_path in glob.glob(os.path.join(detected_dir, "*")):
-        filename = os.path.basename(img_path)
+    for filename, img_path in detected:
         if filename not in used_images:
-            shutil.copy(img_path, os.path.join(unmatched_dir, filename))
+            layout.place(img_path, "unmatched", filename)
+            metrics.inc("match_images_total", category="unmatched")
+    layout.save()
+    store.save()
+    lap("place", user, start)
 
     print(f"\nFinished for {user}")
 
-for user in selected_users:
-    self_train_user(user)
+def get_face_app():
+    global face_app
+    with model_lock:
+        if face_app is None:
+            from insightface.app import FaceAnalysis
+            face_app = FaceAnalysis(name="antelopev2", root="./", providers=['CUDAExecutionProvider'])
+            face_app.prepare(ctx_id=0)
+    return face_app
+
+def face_key():
+    """The settings that change what analyze() finds, worker.py has to use the same."""
+    return "|".join(str(value) for value in (face_crop, crop_padding, crop_det_size, crop_max_area))
+
+def connect_worker():
+    """Use worker.py when it analyzes faces and samples videos the same way this run would."""
+    global worker
+    worker = connect(config.get("worker_socket"))
+    if worker is None:
+        return
+    # Video faces are looked up by frame index in detections.json, the frames have to be the same
+    if worker.info.get("face_key") != face_key() or worker.info["sampling_key"] != sampling_key(config):
+        print("Inference Worker Uses Other Face or Sampling Settings, Running Locally")
+        worker.close()
+        worker = None
+        return
+    print(f"Using Inference Worker (PID {worker.info['pid']})")
+
+def main():
+    global metrics, match_mode, hashes, pool
+    parser = target_parser("Find the images of each target among its detected media.")
+    parser.add_argument("--mode", choices=("descent", "cluster"), help="Override match_mode of setting.json")
+    parser.add_argument("--processes", type=int, default=config.get("shard_processes", 0),
+                        help="Embed in this many processes and match that many targets at once")
+    args = parser.parse_args()
+    selected_users = selected_targets(args, "Self-Train")
+    match_mode = args.mode or match_mode
+
+    metrics = Metrics.from_config("match", config)
+    if hash_kind:
+        hashes = HashCache(os.path.join("output", "hashes.db"), hash_kind)
+    connect_worker()
+    if worker is None and args.processes > 1:
+        print(f"Embedding in {args.processes} Processes")
+        pool = create_pool(args.processes, shard_threads, init_shard)
+
+    def run(user):
+        # stream.py may add to the same output folder meanwhile
+        with user_lock(os.path.join("output", user)):
+            self_train_user(user)
+    # Every target only writes its own output folder, so they can run side by side
+    for_each(run, selected_users, args.processes if pool is not None else 1)
+    if pool is not None:
+        pool.shutdown()
+    if hashes is not None:
+        hashes.close()
+    if worker is not None:
+        worker.close()
+    metrics.finish(config.get("metrics_notify", False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import threading
+import requests
+from contextlib import contextmanager
+from datetime import datetime
+
+PREFIX = "instagram_collector_"
+
+def label_text(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+class Metrics:
+    """Counters, gauges and timers of one run (job), to tell where the time went.
+
+    Every timer observation is appended to <directory>/<job>.jsonl as it
+    happens, together with a snapshot of all counters and gauges on every
+    flush. Each flush also replaces <directory>/<job>.prom, a Prometheus
+    textfile for node_exporter's textfile collector. Without a directory
+    nothing is written and the numbers only feed summary().
+    """
+
+    def __init__(self, job, directory=None, flush_interval=15):
+        self.job = job
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        # Workers may trigger a flush at the same time, only one writes the files
+        self.flush_lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        # key -> [count, sum, max]
+        self.timers = {}
+        self.events = []
+        self.started = time.monotonic()
+        self.flushed = self.started
+
+    @classmethod
+    def from_config(cls, job, config):
+        return cls(job, config.get("metrics_dir"), config.get("metrics_flush_interval", 15))
+
+    def key(self, name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self.maybe_flush()
+
+    def gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self.key(name, labels)] = value
+        self.maybe_flush()
+
+    def observe(self, name, seconds, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            timer = self.timers.setdefault(key, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+            if self.directory:
+                self.events.append({"time": datetime.now().isoformat(timespec="milliseconds"), "type": "timer",
+                                    "name": name, "seconds": round(seconds, 4), **labels})
+        self.maybe_flush()
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    def maybe_flush(self):
+        if self.directory and time.monotonic() - self.flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if not self.directory:
+            return
+        with self.flush_lock:
+            self.write()
+
+    def write(self):
+        with self.lock:
+            self.flushed = time.monotonic()
+            events, self.events = self.events, []
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            timers = {key: list(value) for key, value in self.timers.items()}
+
+        snapshot = {
+            "time": datetime.now().isoformat(timespec="milliseconds"),
+            "type": "snapshot",
+            "uptime": round(self.flushed - self.started, 3),
+            "counters": {name + label_text(dict(labels)): value for (name, labels), value in counters.items()},
+            "gauges": {name + label_text(dict(labels)): value for (name, labels), value in gauges.items()},
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, f"{self.job}.jsonl"), "a", encoding="utf-8") as f:
+            for event in events + [snapshot]:
+                f.write(json.dumps(event) + "\n")
+
+        lines = []
+        typed = set()
+
+        def add(name, kind, labels, samples):
+            # Every line of a metric family has to follow its TYPE line
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+            text = label_text({"job": self.job, **dict(labels)})
+            lines.extend(f"{PREFIX}{name}{suffix}{text} {value}" for suffix, value in samples)
+
+        for (name, labels), value in sorted(counters.items()):
+            add(name, "counter", labels, [("", value)])
+        for (name, labels), value in sorted(gauges.items()):
+            add(name, "gauge", labels, [("", value)])
+        for (name, labels), (count, total, _) in sorted(timers.items()):
+            add(name, "summary", labels, [("_count", count), ("_sum", f"{total:.6f}")])
+        for (name, labels), (_, _, peak) in sorted(timers.items()):
+            add(f"{name}_max", "gauge", labels, [("", f"{peak:.6f}")])
+
+        prom_path = os.path.join(self.directory, f"{self.job}.prom")
+        tmp_path = prom_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, prom_path)
+
+    def summary(self):
+        """Totals of the run as text, counters with their rate, timers with their mean and max."""
+        elapsed = time.monotonic() - self.started
+        with self.lock:
+            counters = sorted(self.counters.items())
+            timers = sorted(self.timers.items())
+        lines = [f"{self.job.title()} Summary ({elapsed:.0f} Seconds)"]
+        for (name, labels), value in counters:
+            lines.append(f"{name}{label_text(dict(labels))}: {value:g} ({value / elapsed:.2f}/s)")
+        for (name, labels), (count, total, peak) in timers:
+            lines.append(f"{name}{label_text(dict(labels))}: {count} x {total / count:.3f}s Mean, "
+                         f"{peak:.3f}s Max, {total:.1f}s Total")
+        return "\n".join(lines)
+
+    def notify(self, webhook):
+        """Send summary() to the Discord webhook, cut to fit one message."""
+        try:
+            response = requests.post(webhook, json={"content": self.summary()[:1990]})
+            response.raise_for_status()
+            print("Discord Notification Sent")
+        except Exception as e:
+            print(f"Failed to Send Discord Notification: {e}")
+
+    def close(self):
+        self.flush()
+
+    def finish(self, notify=False):
+        """Flush and print the summary at the end of a run, also sending it to the webhook of .env with notify."""
+        self.close()
+        print(self.summary())
+        if notify:
+            from dotenv import load_dotenv
+            load_dotenv()
+            webhook = os.getenv("webhook")
+            if webhook:
+                self.notify(webhook)
@@ -0,0 +1,165 @@
+import os
+import sqlite3
+import threading
+import cv2
+import numpy as np
+
+def pack(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+def dhash(gray):
+    """64 bits, whether each pixel of a 9x8 thumbnail is brighter than its left neighbour."""
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return pack(small[:, 1:] > small[:, :-1])
+
+def phash(gray):
+    """64 bits, the lowest 8x8 DCT frequencies of a 32x32 thumbnail against their median."""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    # The DC term only carries the brightness
+    return pack(low > np.median(low.ravel()[1:]))
+
+HASHES = {"phash": phash, "dhash": dhash}
+
+def hamming(value, values):
+    """Number of bits value differs in from each of values, a uint64 array."""
+    diff = np.bitwise_xor(values, np.uint64(value))
+    return np.unpackbits(diff.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+class HashCache:
+    """Perceptual hash of every image, computed once per file and kept in sqlite.
+
+    A path is hashed again only when its size or mtime changed. Images are
+    decoded in grayscale at a quarter of their size, which JPEG decodes
+    without the full-size pass; width and height are those of the reduced
+    image and only serve as ratios between near-duplicates.
+    """
+
+    def __init__(self, path, kind="phash"):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.kind = kind
+        self.hash = HASHES[kind]
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                hash TEXT,
+                width INTEGER,
+                height INTEGER,
+                PRIMARY KEY (path, kind)
+            );
+        """)
+        self.conn.commit()
+
+    def compute(self, path):
+        gray = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        if gray is None:
+            return None
+        return self.hash(gray), gray.shape[1], gray.shape[0]
+
+    def hashes(self, paths):
+        """{path: (hash, width, height)} for paths, None for images that can't be read."""
+        keys = {path: os.path.abspath(path) for path in paths}
+        with self.lock:
+            rows = {}
+            for path in keys.values():
+                row = self.conn.execute("SELECT size, mtime, hash, width, height FROM hashes WHERE path = ? AND kind = ?",
+                                        (path, self.kind)).fetchone()
+                if row:
+                    rows[path] = row
+
+        found = {}
+        new_rows = []
+        for path, key in keys.items():
+            stat = os.stat(key)
+            row = rows.get(key)
+            if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+                found[path] = None if row[2] is None else (int(row[2], 16), row[3], row[4])
+                continue
+            entry = self.compute(key)
+            found[path] = entry
+            value, width, height = entry if entry else (None, None, None)
+            new_rows.append((key, self.kind, stat.st_size, stat.st_mtime,
+                             None if value is None else f"{value:016x}", width, height))
+        if new_rows:
+            with self.lock:
+                self.conn.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)", new_rows)
+                self.conn.commit()
+        return found
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class HammingIndex:
+    """64-bit hashes searchable by Hamming distance.
+
+    Every hash is split into distance + 1 bands and filed under each band's
+    value. Two hashes at most distance bits apart agree on at least one band
+    entirely, so only the hashes sharing a band are compared.
+    """
+
+    def __init__(self, distance):
+        self.distance = distance
+        width = -(-64 // (distance + 1))
+        self.bands = [(start, min(width, 64 - start)) for start in range(0, 64, width)]
+        self.buckets = [{} for _ in self.bands]
+        self.values = []
+
+    def keys(self, value):
+        return [(value >> start) & ((1 << width) - 1) for start, width in self.bands]
+
+    def add(self, value):
+        item = len(self.values)
+        self.values.append(value)
+        for bucket, key in zip(self.buckets, self.keys(value)):
+            bucket.setdefault(key, []).append(item)
+        return item
+
+    def nearest(self, value):
+        """Index of the closest hash within distance, None when there is none."""
+        candidates = sorted({item for bucket, key in zip(self.buckets, self.keys(value)) for item in bucket.get(key, ())})
+        if not candidates:
+            return None
+        distances = hamming(value, np.array([self.values[item] for item in candidates], dtype=np.uint64))
+        best = int(np.argmin(distances))
+        return candidates[best] if distances[best] <= self.distance else None
+
+def group(paths, hashes, distance):
+    """{representative: [members]} of near-duplicate images, paths given in order of preference.
+
+    Each path joins the group of the first representative within distance or
+    starts its own. Comparing with the representative only keeps a chain of
+    small edits from merging unrelated images, and the results copied from
+    it stay close to what the member itself would give.
+    """
+    index = HammingIndex(distance)
+    representatives = []
+    groups = {}
+    for path in paths:
+        entry = hashes.get(path)
+        if entry is None:
+            groups[path] = []
+            continue
+        item = index.nearest(entry[0])
+        if item is None:
+            index.add(entry[0])
+            representatives.append(path)
+            groups[path] = []
+        else:
+            groups[representatives[item]].append(path)
+    return groups
+
+def copy_key(kind, distance):
+    """Tag of results copied from a group's representative, valid only while grouping runs with these settings."""
+    return f"copied|{kind}|{distance}"
+
+def ratio(hashes, source, target):
+    """(x, y) factors taking coordinates in source to the same point in target."""
+    _, source_width, source_height = hashes[source]
+    _, target_width, target_height = hashes[target]
+    return target_width / source_width, target_height / source_height
@@ -0,0 +1,83 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def model_key(model_path, backend, imgsz, conf, iou):
+    """Identify a model version: the weights file as it is on disk plus everything that changes its output."""
+    stat = os.stat(model_path)
+    return f"{os.path.abspath(model_path)}|{stat.st_size}|{int(stat.st_mtime)}|{backend}|{imgsz}|{conf}|{iou}"
+
+class ResultCache:
+    """Detection boxes per image content and model version.
+
+    Images are identified by the SHA-1 of their content, so renamed or copied
+    files hit the cache too. The hash is only recomputed when a path's size or
+    mtime changed. Boxes of every class down to the model's confidence floor
+    are stored, the target class and threshold are applied by the caller.
+    Results the model didn't produce itself are stored under a variant of the
+    key, they are only found by asking for that variant.
+    """
+
+    def __init__(self, path, key):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.key = key
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                digest TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                digest TEXT NOT NULL,
+                model TEXT NOT NULL,
+                boxes TEXT NOT NULL,
+                PRIMARY KEY (digest, model)
+            );
+        """)
+        self.conn.commit()
+
+    def digest(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            row = self.conn.execute("SELECT size, mtime, digest FROM files WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return row[2]
+        digest = file_digest(path)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (path, stat.st_size, stat.st_mtime, digest))
+            self.conn.commit()
+        return digest
+
+    def model(self, variant=None):
+        return self.key if variant is None else f"{self.key}|{variant}"
+
+    def get(self, path, variant=None):
+        digest = self.digest(path)
+        with self.lock:
+            row = self.conn.execute("SELECT boxes FROM results WHERE digest = ? AND model = ?",
+                                    (digest, self.model(variant))).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, path, boxes, variant=None):
+        digest = self.digest(path)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                              (digest, self.model(variant), json.dumps(boxes)))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,90 @@
+import json
+import time
+import random
+import threading
+from datetime import datetime
+
+class Scheduler:
+    """Paces Instagram API calls and CDN transfers on separate budgets.
+
+    API calls are spaced by a random interval drawn from api_delay, counted from
+    the end of the previous call, so time spent listing or queueing downloads
+    already counts towards the gap. CDN transfers are not paced at all unless
+    cdn_rate_limit (bytes/s, shared by every worker) is set. Every decision is
+    printed and, with log_path, appended as one JSON line. With metrics, waits,
+    API latencies and errors and CDN throttling are recorded too.
+    """
+
+    def __init__(self, api_delay=(15, 30), target_delay=(50, 70), cdn_rate_limit=0, log_path=None, metrics=None):
+        self.api_delay = api_delay
+        self.target_delay = target_delay
+        self.cdn_rate_limit = cdn_rate_limit
+        self.log_path = log_path
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.last_api = None
+        self.api_calls = 0
+        self.waited = 0.0
+
+        # Token bucket for CDN bytes, one second of burst
+        self.tokens = float(cdn_rate_limit)
+        self.refilled = time.monotonic()
+
+    def log(self, event, **fields):
+        entry = {"time": datetime.now().isoformat(timespec="seconds"), "event": event, **fields}
+        if self.log_path:
+            with self.lock, open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def wait_gap(self, gap, reason):
+        elapsed = time.monotonic() - self.last_api if self.last_api is not None else gap
+        delay = max(0.0, gap - elapsed)
+        print(f"Scheduler: {reason} Waiting {delay:.2f} Seconds (Gap {gap:.2f}, Elapsed {elapsed:.2f})")
+        self.log("wait", reason=reason, gap=round(gap, 3), elapsed=round(elapsed, 3), delay=round(delay, 3))
+        if self.metrics:
+            self.metrics.observe("scheduler_wait_seconds", delay, reason="target" if reason == "Next Target" else "api")
+        if delay:
+            time.sleep(delay)
+            self.waited += delay
+
+    def api(self, func, *args, **kwargs):
+        """Call an instagrapi method once the API budget allows it."""
+        name = getattr(func, "__name__", "api")
+        if self.last_api is not None:
+            self.wait_gap(random.uniform(*self.api_delay), name)
+        start = time.monotonic()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            if self.metrics:
+                self.metrics.inc("api_errors_total", call=name)
+            raise
+        finally:
+            self.last_api = time.monotonic()
+            self.api_calls += 1
+            self.log("api", call=name, latency=round(self.last_api - start, 3))
+            if self.metrics:
+                self.metrics.observe("api_seconds", self.last_api - start, call=name)
+
+    def next_target(self):
+        """Gap between two targets, also measured from the last API call."""
+        if self.last_api is not None:
+            self.wait_gap(random.uniform(*self.target_delay), "Next Target")
+
+    def transfer(self, size):
+        """Block a CDN worker until size bytes fit in the bandwidth budget."""
+        if not self.cdn_rate_limit:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.cdn_rate_limit, self.tokens + (now - self.refilled) * self.cdn_rate_limit)
+            self.refilled = now
+            self.tokens -= size
+            delay = -self.tokens / self.cdn_rate_limit if self.tokens < 0 else 0.0
+        if delay:
+            if self.metrics:
+                self.metrics.inc("cdn_throttled_seconds_total", delay)
+            time.sleep(delay)
+
+    def summary(self):
+        return f"{self.api_calls} API Calls, {self.waited:.0f} Seconds Waited"
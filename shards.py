@@ -0,0 +1,86 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import cv2
+
+THREAD_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+def pin_threads(threads):
+    """Limit OpenCV, torch and ONNX Runtime of this process to threads, so shards don't fight over the cores."""
+    cv2.setNumThreads(threads)
+    limit_onnx_threads(threads)
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+
+def limit_onnx_threads(threads):
+    """Give every ONNX Runtime session of this process threads intra-op threads unless it brings its own options.
+
+    ORT sizes its pool by the cores and ignores the OMP variables, and
+    neither insightface's FaceAnalysis (AntelopeV2) nor ultralytics (backend
+    onnx) pass session options through to the sessions they create.
+    """
+    try:
+        import onnxruntime
+    except ImportError:
+        return
+    init = onnxruntime.InferenceSession.__init__
+
+    def limited(self, path_or_bytes, sess_options=None, *args, **kwargs):
+        if sess_options is None:
+            sess_options = onnxruntime.SessionOptions()
+            sess_options.intra_op_num_threads = threads
+            sess_options.inter_op_num_threads = 1
+        init(self, path_or_bytes, sess_options, *args, **kwargs)
+    onnxruntime.InferenceSession.__init__ = limited
+
+def start(threads, initializer, initargs):
+    pin_threads(threads)
+    initializer(*initargs)
+
+def create_pool(processes, threads, initializer, initargs=()):
+    """Processes that each run initializer once, to load their model, before taking chunks.
+
+    They are spawned rather than forked, a forked CUDA or ONNX Runtime
+    context doesn't survive in the child. The thread variables are read by
+    the BLAS libraries when a child imports numpy, so they are set here.
+    """
+    for var in THREAD_VARS:
+        os.environ[var] = str(threads)
+    return ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=start, initargs=(threads, initializer, initargs))
+
+def run_chunks(pool, function, items, size, local):
+    """Yield the results of function over items, computed in chunks of size by the pool.
+
+    All chunks are queued at once and the results come back in the order of
+    items, whichever process finishes first. A chunk whose process failed is
+    computed again with local in this process.
+    """
+    futures = [(items[i:i + size], pool.submit(function, items[i:i + size])) for i in range(0, len(items), size)]
+    for chunk, future in futures:
+        try:
+            results = future.result()
+        except Exception as e:
+            print(f"Shard Failed ({type(e).__name__}: {e}), Running Locally")
+            results = local(chunk)
+        yield from results
+
+def serialized(function, lock):
+    """function called under lock, for a model of this process that for_each threads share."""
+    def call(*args):
+        with lock:
+            return function(*args)
+    return call
+
+def for_each(function, items, threads):
+    """function(item) for every item, threads of them at a time, the first error is raised."""
+    if threads <= 1:
+        for item in items:
+            function(item)
+        return
+    with ThreadPoolExecutor(threads) as executor:
+        for _ in executor.map(function, items):
+            pass
@@ -0,0 +1,116 @@
+import os
+import time
+import signal
+import argparse
+import threading
+import detection
+import match
+from inbox import Inbox
+from layout import OutputLayout, user_lock
+from metrics import Metrics
+from neardup import HashCache
+from resultcache import ResultCache, model_key
+from video import video_extensions, sampling_key
+
+config = detection.config
+stream_queue = config.get("stream_queue") or "data/stream.db"
+batch = config.get("stream_batch", 64)
+# A batch not acked within this many seconds is handed out again
+lease_seconds = config.get("stream_lease", 600)
+poll_interval = config.get("stream_poll_interval", 5)
+max_attempts = config.get("stream_max_attempts", 5)
+# Processed files are kept in the queue this long before they are purged
+keep_done = config.get("stream_keep_done", 604800)
+
+stop = threading.Event()
+
+def process(user, paths, embed=True):
+    """Detect the new files of a user, then embed whatever of them got detected."""
+    images = [path for path in paths if path.lower().endswith(detection.image_extensions)]
+    videos = [path for path in paths if path.lower().endswith(video_extensions)]
+    user_dir = os.path.join("output", user)
+    # match.py may be sorting the same user, its index would drop these entries
+    with user_lock(user_dir):
+        detection.detect_files(user, images, videos)
+        if embed:
+            match.embed_detected(OutputLayout(user_dir, match.output_mode))
+
+def run(inbox, embed=True):
+    """Process files as download.py announces them, until SIGINT/SIGTERM.
+
+    A batch is acked per target once its detections and embeddings are
+    saved, a crash before that leaves it to be leased again.
+    """
+    while not stop.is_set():
+        leased = inbox.lease(batch, lease_seconds)
+        if not leased:
+            stop.wait(poll_interval)
+            continue
+
+        targets = {}
+        for item in leased:
+            targets.setdefault(item[2], []).append(item)
+        for user, items in targets.items():
+            ids = [item_id for item_id, *_ in items]
+            # Files removed since they were announced have nothing left to process
+            paths = [path for _, path, *_ in items if os.path.exists(path)]
+            try:
+                with detection.metrics.timer("stream_batch_seconds"):
+                    process(user, paths, embed)
+            except Exception as e:
+                print(f"Processing {len(ids)} Files of {user} Failed: {e}")
+                inbox.fail(ids, f"{type(e).__name__}: {e}")
+                detection.metrics.inc("stream_files_total", len(ids), result="failed")
+                continue
+            inbox.ack(ids)
+            now = time.time()
+            detection.metrics.inc("stream_files_total", len(ids), result="done")
+            detection.metrics.observe("stream_latency_seconds", max(now - added for *_, added in items))
+        print(f"Processed {len(leased)} Files, {inbox.pending()} Waiting")
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect and embed files as soon as download.py or daemon.py finished them.")
+    parser.add_argument("--device", help="Override device of config.json, e.g. cpu or cuda:1")
+    parser.add_argument("--no-embed", action="store_true", help="Only detect, leave the embedding to match.py")
+    args = parser.parse_args()
+    if not config.get("stream_queue"):
+        print("stream_queue Is Not Set in config.json, download.py Won't Announce New Files")
+
+    metrics = Metrics.from_config("stream", config)
+    detection.metrics = match.metrics = metrics
+    detection.device = args.device or detection.device
+    detection.cache = ResultCache(os.path.join("output", "detection_cache.db"),
+                                  model_key(detection.model_path, detection.backend, detection.imgsz,
+                                            detection.conf_floor, detection.iou))
+    detection.video_cache = ResultCache(os.path.join("output", "detection_cache.db"),
+                                        f"{detection.cache.key}|{sampling_key(config)}")
+    if detection.hash_kind:
+        detection.hashes = match.hashes = HashCache(os.path.join("output", "hashes.db"), detection.hash_kind)
+    detection.connect_worker()
+    if not args.no_embed:
+        match.connect_worker()
+
+    inbox = Inbox(stream_queue, max_attempts)
+    inbox.purge(keep_done)
+
+    def shutdown(signum, frame):
+        print("Stopping After the Current Batch")
+        stop.set()
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    print(f"Streaming from {stream_queue}, {inbox.pending()} Files Waiting")
+    run(inbox, embed=not args.no_embed)
+
+    inbox.close()
+    detection.cache.close()
+    detection.video_cache.close()
+    if detection.hashes is not None:
+        detection.hashes.close()
+    for module in (detection, match):
+        if module.worker is not None:
+            module.worker.close()
+    metrics.finish(config.get("metrics_notify", False))
+
+if __name__ == "__main__":
+    main()
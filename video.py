@@ -0,0 +1,142 @@
+import cv2
+
+video_extensions = ('.mp4', '.mov', '.m4v', '.webm')
+# Frames beyond which sample_frames seeks instead of grabbing, about the keyframe interval of a 30 fps clip
+SEEK_GAP = 60
+# Set once the missing PyAV was reported, keyframe sampling falls back to stride for every clip
+warned = False
+
+def is_video(path):
+    return path.lower().endswith(video_extensions)
+
+def histogram(frame):
+    small = cv2.resize(frame, (64, 64), interpolation=cv2.INTER_AREA)
+    hist = cv2.calcHist([cv2.cvtColor(small, cv2.COLOR_BGR2HSV)], [0, 2], None, [16, 16], [0, 180, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+def keyframes(path, max_frames):
+    """Decode the keyframe at or before each of max_frames points spread over a clip, needs PyAV.
+
+    Each point is reached with a seek, so only max_frames keyframes are
+    decoded whatever the length. A clip whose duration isn't known gets its
+    first max_frames keyframes. Points sharing a keyframe give it once.
+    """
+    import av
+    frames = []
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        stream.codec_context.skip_frame = "NONKEY"
+        rate = float(stream.average_rate or 30)
+        duration = stream.duration
+        if duration is None and container.duration:
+            duration = int(container.duration / av.time_base / stream.time_base)
+        if not duration:
+            for frame in container.decode(stream):
+                index = int(round(frame.time * rate)) if frame.time is not None else len(frames)
+                frames.append((index, frame.to_ndarray(format="bgr24")))
+                if len(frames) >= max_frames:
+                    break
+            return frames
+
+        start = stream.start_time or 0
+        seen = set()
+        for point in range(max_frames):
+            container.seek(start + duration * point // max_frames, stream=stream, any_frame=False, backward=True)
+            frame = next(container.decode(stream), None)
+            if frame is None:
+                continue
+            index = int(round(frame.time * rate)) if frame.time is not None else point
+            if index not in seen:
+                seen.add(index)
+                frames.append((index, frame.to_ndarray(format="bgr24")))
+    return frames
+
+def grid_frames(cap, stride, total):
+    """Yield (frame_index, BGR frame) of every stride-th frame of an open capture.
+
+    Gaps longer than SEEK_GAP are skipped with a seek, which decodes from the
+    keyframe before the target instead of every frame in between. Shorter
+    gaps are grabbed, that costs less than going back to the keyframe.
+    """
+    position = 0
+    for index in range(0, total if total > 0 else 1 << 31, stride):
+        if index - position > SEEK_GAP:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            position = index
+        while position <= index:
+            if not cap.grab():
+                return
+            position += 1
+        ok, frame = cap.retrieve()
+        if ok:
+            yield index, frame
+
+def sample_frames(path, mode="stride", stride=30, max_frames=8, scene_threshold=0.4, scene_candidates=4):
+    """Return up to max_frames (frame_index, BGR frame) pairs from a video, decoded front to back.
+
+    stride takes every stride-th frame, widened so the samples span the whole
+    clip. scene takes frames from a grid widened to scene_candidates per
+    sample but keeps only those whose colour histogram moved by more than
+    scene_threshold since the last kept one. keyframe decodes keyframes only
+    (PyAV), falling back to stride.
+    Only the frames on the grid are converted, see grid_frames for what the
+    ones in between cost.
+    """
+    if mode == "keyframe":
+        try:
+            return keyframes(path, max_frames)
+        except ImportError:
+            global warned
+            if not warned:
+                print("PyAV Is Not Installed, Sampling Videos by Stride Instead of Keyframes")
+                warned = True
+            mode = "stride"
+
+    if max_frames <= 0:
+        return []
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        return []
+
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if total > 0:
+        samples = max_frames if mode == "stride" else max_frames * scene_candidates
+        stride = max(stride, -(-total // samples))
+
+    frames = []
+    previous = None
+    try:
+        for index, frame in grid_frames(cap, stride, total):
+            if mode == "scene":
+                current = histogram(frame)
+                changed = previous is None or 1 - cv2.compareHist(previous, current, cv2.HISTCMP_CORREL) > scene_threshold
+                if changed:
+                    previous = current
+                    frames.append((index, frame))
+            else:
+                frames.append((index, frame))
+            # Stop before the generator decodes another frame
+            if len(frames) >= max_frames:
+                break
+    finally:
+        cap.release()
+    return frames
+
+def sampler(config):
+    """sample_frames bound to the video_* keys of config.json."""
+    def sample(path):
+        return sample_frames(
+            path,
+            mode=config.get("video_sampling", "stride"),
+            stride=config.get("video_stride", 30),
+            max_frames=config.get("video_max_frames", 8),
+            scene_threshold=config.get("video_scene_threshold", 0.4),
+            scene_candidates=config.get("video_scene_candidates", 4),
+        )
+    return sample
+
+def sampling_key(config):
+    keys = [("video_sampling", "stride"), ("video_stride", 30), ("video_max_frames", 8), ("video_scene_threshold", 0.4)]
+    if config.get("video_sampling", "stride") == "scene":
+        keys.append(("video_scene_candidates", 4))
+    return "|".join(str(config.get(key, default)) for key, default in keys)
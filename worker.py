@@ -0,0 +1,133 @@
+import os
+import json
+import socket
+import argparse
+import threading
+from multiprocessing.connection import Listener, Client
+
+class WorkerError(Exception):
+    pass
+
+class WorkerClient:
+    """Connection to a running worker.py, one request and one reply at a time."""
+
+    def __init__(self, address):
+        self.conn = Client(address, family="AF_UNIX")
+        self.info = self.call("ping")
+
+    def call(self, op, **kwargs):
+        self.conn.send({"op": op, **kwargs})
+        reply = self.conn.recv()
+        if "error" in reply:
+            raise WorkerError(reply["error"])
+        return reply["result"]
+
+    def detect(self, paths):
+        """[(path, boxes)] like extract_boxes, boxes is None for unreadable images. Paths have to be absolute."""
+        return self.call("detect", paths=paths)
+
+    def detect_videos(self, paths):
+        """[(path, [[frame_index, boxes]])], None for videos that can't be decoded."""
+        return self.call("detect_videos", paths=paths)
+
+    def embed(self, items):
+        """Faces of every (path, persons) item, in the format of match.analyze."""
+        return self.call("embed", items=items)
+
+    def close(self):
+        self.conn.close()
+
+def connect(address):
+    """A client for the worker listening on address, None when there is none."""
+    if not address or not hasattr(socket, "AF_UNIX") or not os.path.exists(address):
+        return None
+    try:
+        return WorkerClient(address)
+    except (OSError, EOFError, WorkerError) as e:
+        print(f"Inference Worker Not Reachable ({e}), Running Locally")
+        return None
+
+def serve(address, preload=True):
+    """Keep the YOLO engine and the face models loaded and answer requests on a Unix socket.
+
+    Requests are the dicts WorkerClient sends, one model call runs at a time
+    while any number of clients stay connected. The socket is only
+    accessible to the user running the worker.
+    """
+    import detection
+    import match
+    from metrics import Metrics
+    from resultcache import model_key
+    from video import sampling_key
+
+    metrics = Metrics.from_config("worker", detection.config)
+    detection.metrics = metrics
+    match.metrics = metrics
+    info = {
+        "pid": os.getpid(),
+        "detect_key": model_key(detection.model_path, detection.backend, detection.imgsz, detection.conf_floor, detection.iou),
+        "sampling_key": sampling_key(detection.config),
+        "face_key": match.face_key(),
+    }
+    lock = threading.Lock()
+
+    if preload:
+        detection.get_engine()
+        match.get_face_app()
+
+    def handle(request):
+        op = request.get("op")
+        if op == "ping":
+            return info
+        if op == "detect":
+            return detection.detect_chunk(request["paths"])
+        if op == "detect_videos":
+            return detection.detect_video_chunk(request["paths"])
+        if op == "embed":
+            return match.embed_chunk(request["items"])
+        raise WorkerError(f"Unknown Request {op}")
+
+    def client(conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    with lock, metrics.timer("worker_request_seconds", op=str(request.get("op"))):
+                        reply = {"result": handle(request)}
+                except Exception as e:
+                    reply = {"error": f"{type(e).__name__}: {e}"}
+                conn.send(reply)
+
+    if os.path.exists(address):
+        os.remove(address)
+    os.makedirs(os.path.dirname(os.path.abspath(address)), exist_ok=True)
+    umask = os.umask(0o177)
+    try:
+        listener = Listener(address, family="AF_UNIX")
+    finally:
+        os.umask(umask)
+    print(f"Inference Worker Listening on {address}")
+    try:
+        while True:
+            conn = listener.accept()
+            threading.Thread(target=client, args=(conn,), daemon=True).start()
+    except KeyboardInterrupt:
+        print("Stopping Inference Worker")
+    finally:
+        listener.close()
+        metrics.finish()
+
+def main():
+    with open("config.json", "r", encoding="utf-8") as f:
+        config = json.load(f)
+    parser = argparse.ArgumentParser(description="Keep the detection and face models loaded for detection.py and match.py.")
+    parser.add_argument("--socket", default=config.get("worker_socket", "data/worker.sock"), help="Unix socket to listen on")
+    parser.add_argument("--lazy", action="store_true", help="Load each model on its first request instead of at start")
+    args = parser.parse_args()
+    serve(args.socket, preload=not args.lazy)
+
+if __name__ == "__main__":
+    main()